@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 from typing import TYPE_CHECKING
 
@@ -6,6 +7,9 @@ import structlog
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from scimate_agent.nodes.code_verifier import shutdown_verification_pool
+from scimate_agent.utils import fast_json
+from scimate_agent.utils.http import aclose_shared_async_http_client
 from scimate_agent.utils.logging import setup_logging
 from .middlewares import CorrelationMiddleware
 from .websocket import SciMateAgentWebsocketHandler
@@ -27,6 +31,9 @@ async def lifespan(app: FastAPI):
     yield
     await logger.ainfo("Shutting down...")
     await websocket_handler.stop()
+    # Waits for the workers to exit, off the event loop
+    await asyncio.to_thread(shutdown_verification_pool)
+    await aclose_shared_async_http_client()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -41,7 +48,7 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*")
+sio = socketio.AsyncServer(async_mode="asgi", cors_allowed_origins="*", json=fast_json)
 combined_asgi_app = socketio.ASGIApp(sio, app)
 
 
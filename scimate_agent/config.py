@@ -1,4 +1,4 @@
-from pydantic import BaseModel, ConfigDict
+from pydantic import BaseModel, ConfigDict, PrivateAttr
 
 
 class AgentConfig(BaseModel):
@@ -9,6 +9,14 @@ class AgentConfig(BaseModel):
     llm_model: str = "gpt-4o"
     llm_temperature: float = 0.0
 
+    # History compression
+    compress_history: bool = False
+    compress_history_keep_last: int = 4
+    # Keep only the last `history_window` rounds verbatim and summarize the older ones
+    history_window: int | None = None
+    # Model used to summarize the history, defaults to `llm_model`
+    history_summary_llm_model: str | None = None
+
     # Event
     event_handle: str | None = None
 
@@ -18,9 +26,81 @@ class AgentConfig(BaseModel):
     session_id: str | None = None
 
     # Code Verification
+    # Verify the code in a process pool instead of a thread, for many concurrent sessions
+    verify_code_in_process_pool: bool = False
+    # Upper bound of the pool's workers, also bounded by the number of CPUs
+    verify_code_pool_max_workers: int = 4
     allowed_modules: list[str] | None = None
     blocked_modules: list[str] | None = None
     allowed_functions: list[str] | None = None
     blocked_functions: list[str] | None = None
     allowed_variables: list[str] | None = None
     blocked_variables: list[str] | None = None
+
+    # Requirements text by role name, computed on first use since the config is frozen
+    _requirements_text: dict[str, str] = PrivateAttr(default_factory=dict)
+
+    def get_requirements_text(self, role_name: str) -> str:
+        if role_name in self._requirements_text:
+            return self._requirements_text[role_name]
+
+        allowed_modules = self.allowed_modules
+        blocked_modules = self.blocked_modules
+        allowed_functions = self.allowed_functions
+        blocked_functions = self.blocked_functions
+        allowed_variables = self.allowed_variables
+        blocked_variables = self.blocked_variables
+
+        requirements: list[str] = []
+
+        if allowed_modules is not None:
+            if len(allowed_modules) > 0:
+                requirements.append(
+                    f"- {role_name} can only import the following Python modules: "
+                    + ", ".join([f"{module}" for module in allowed_modules]),
+                )
+            else:
+                requirements.append(f"- {role_name} cannot import any Python modules.")
+
+        if blocked_modules is not None:
+            if len(blocked_modules) > 0:
+                requirements.append(
+                    f"- {role_name} cannot use the following Python modules: "
+                    + ", ".join([f"{module}" for module in blocked_modules]),
+                )
+
+        if allowed_functions is not None:
+            if len(allowed_functions) > 0:
+                requirements.append(
+                    f"- {role_name} can only use the following Python functions: "
+                    + ", ".join([f"{func}" for func in allowed_functions]),
+                )
+            else:
+                requirements.append(f"- {role_name} cannot use any Python functions.")
+
+        if blocked_functions is not None:
+            if len(blocked_functions) > 0:
+                requirements.append(
+                    f"- {role_name} cannot use the following Python functions: "
+                    + ", ".join([f"{func}" for func in blocked_functions]),
+                )
+
+        if allowed_variables is not None:
+            if len(allowed_variables) > 0:
+                requirements.append(
+                    f"- {role_name} can only use the following variables: "
+                    + ", ".join([f"{var}" for var in allowed_variables]),
+                )
+            else:
+                requirements.append(f"- {role_name} cannot use any variables.")
+
+        if blocked_variables is not None:
+            if len(blocked_variables) > 0:
+                requirements.append(
+                    f"- {role_name} cannot use the following variables: "
+                    + ", ".join([f"{var}" for var in blocked_variables]),
+                )
+
+        text = "\n".join(requirements)
+        self._requirements_text[role_name] = text
+        return text
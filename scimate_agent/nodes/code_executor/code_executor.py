@@ -313,10 +313,9 @@ async def code_executor_node(state: CodeInterpreterState, config: RunnableConfig
 
 
 def code_executor_router_edge(state: CodeInterpreterState) -> str:
-    rounds = state.get_rounds()
-    assert len(rounds) > 0, "No round found for CodeExecutor."
+    last_round = state.get_last_round()
+    assert last_round is not None, "No round found for CodeExecutor."
 
-    last_round = rounds[-1]
     if len(last_round.posts) == 0:
         raise ValueError("No post found for CodeExecutor.")
     last_post = last_round.posts[-1]
@@ -1,3 +1,4 @@
+import json
 import os
 import sys
 
@@ -11,7 +12,22 @@ def start_kernel_app():
 
     ZMQInteractiveShell.displayhook_class = ZMQShellDisplayHook
 
-    app = IPKernelApp.instance()
+    conn_info = os.environ.get("SCIMATE_CONN_INFO_JSON", None)
+
+    class SciMateKernelApp(IPKernelApp):
+        def init_connection_file(self):
+            if conn_info is None:
+                return super().init_connection_file()
+
+            # The connection info is passed in by the session environment,
+            # which has already written the connection file.
+            self.load_connection_info(json.loads(conn_info))
+
+        def write_connection_file(self):
+            if conn_info is None:
+                return super().write_connection_file()
+
+    app = SciMateKernelApp.instance()
     app.name = "scimate_kernel"
     app.config_file_name = os.path.join(os.path.dirname(__file__), "config.py")
     app.extensions = ["scimate_agent.nodes.code_executor.kernel.magics"]
@@ -4,6 +4,7 @@ from typing import Any
 from IPython.core.interactiveshell import InteractiveShell
 from IPython.core.magic import (
     Magics,
+    cell_magic,
     line_cell_magic,
     line_magic,
     magics_class,
@@ -20,19 +21,6 @@ class SciMatePluginMagic(Magics):
         super().__init__(shell, **kwargs)
         self.executor = executor
 
-    @line_cell_magic
-    def _scimate_register_plugin(self, line: str, cell: str) -> dict[str, Any]:
-        plugin_name = line.strip()
-        plugin_package = cell
-        try:
-            self.executor.register_plugin(plugin_name, plugin_package)
-            return fmt_response(
-                True,
-                f"Plugin `{plugin_name}` registered successfully.",
-            )
-        except Exception as e:
-            return fmt_response(False, f"Failed to register plugin `{plugin_name}`: {e}")
-
     @line_magic
     def _scimate_test_plugin(self, line: str):
         plugin_name = line.strip()
@@ -62,6 +50,27 @@ class SciMatePluginMagic(Magics):
         except Exception as e:
             return fmt_response(False, f"Failed to configure plugin `{plugin_name}`: {e}")
 
+    @needs_local_scope
+    @cell_magic
+    def _scimate_register_and_configure_plugin(
+        self, line: str, cell: str, local_ns: dict[str, Any]
+    ) -> dict[str, Any]:
+        plugin_name = line.strip()
+        # The package is sent as a raw buffer of the execute request,
+        # and the cell body is the JSON config
+        parent = self.shell.kernel.get_parent("shell")
+        try:
+            plugin_package = bytes(parent["buffers"][0])
+            self.executor.register_plugin(plugin_name, plugin_package)
+            self.executor.configure_plugin(plugin_name, json.loads(cell))
+            local_ns[plugin_name] = self.executor.get_plugin_instance(plugin_name)
+            return fmt_response(
+                True,
+                f"Plugin `{plugin_name}` registered and configured successfully.",
+            )
+        except Exception as e:
+            return fmt_response(False, f"Failed to load plugin `{plugin_name}`: {e}")
+
     @needs_local_scope
     @line_magic
     def _scimate_unload_plugin(self, line: str, local_ns: dict[str, Any]):
@@ -1,9 +1,18 @@
+import json
 from typing import Any
 
 
-def fmt_response(is_success: bool, message: str, data: Any = None):
-    return {
-        "is_success": is_success,
-        "message": message,
-        "data": data,
-    }
+class ControlResponse(dict):
+    """A response of the control magics, displayed as JSON so that the client can parse
+    it with `json.loads`."""
+
+    def _repr_pretty_(self, p, cycle: bool) -> None:
+        p.text(json.dumps(self, default=str))
+
+
+def fmt_response(is_success: bool, message: str, data: Any = None) -> ControlResponse:
+    return ControlResponse(
+        is_success=is_success,
+        message=message,
+        data=data,
+    )
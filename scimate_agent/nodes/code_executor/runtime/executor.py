@@ -1,4 +1,3 @@
-import base64
 import os
 import io
 import tarfile
@@ -21,7 +20,7 @@ class PluginTestEntry:
 @dataclass
 class PluginRuntime:
     name: str
-    package: str
+    package: bytes
     config: dict[str, Any] | None = None
     loaded: bool = False
 
@@ -66,9 +65,7 @@ class PluginRuntime:
 
             module_name = self.module_name
             with tempfile.TemporaryDirectory() as tmpdir:
-                package_bytes = base64.b64decode(self.package)
-
-                with tarfile.open(fileobj=io.BytesIO(package_bytes), mode="r") as tar:
+                with tarfile.open(fileobj=io.BytesIO(self.package), mode="r") as tar:
                     tar.extractall(tmpdir)
 
                 module_path = os.path.join(tmpdir, "plugin", f"__init__.py")
@@ -208,7 +205,7 @@ class Executor:
             "outputs": self.ctx.get_normalized_output(),
         }
 
-    def register_plugin(self, plugin_name: str, plugin_package: str) -> None:
+    def register_plugin(self, plugin_name: str, plugin_package: bytes) -> None:
         if plugin_name in self.plugin_registry:
             self.log("warning", f"Plugin `{plugin_name}` already registered.")
 
@@ -25,6 +25,10 @@ class SessionClient:
     async def stop(self) -> None:
         await self.env.stop_session(self.session_id)
 
+    async def reset(self) -> None:
+        await self.env.reset_session(self.session_id)
+        self.loaded_plugins.clear()
+
     async def load_plugin(
         self,
         plugin_name: str,
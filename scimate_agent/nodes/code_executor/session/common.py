@@ -1,11 +1,13 @@
 from dataclasses import dataclass, field
-from typing import Any, Literal, Union
+from typing import Any, Literal, Union, TYPE_CHECKING
 
-from jupyter_client.blocking.client import BlockingKernelClient
 from pydantic import BaseModel
 
 from scimate_agent.plugins import ArtifactType
 
+if TYPE_CHECKING:
+    from jupyter_client.asynchronous.client import AsyncKernelClient
+
 ExecType = Literal["user", "control"]
 ResultMimeType = Union[
     Literal["text/plain", "text/html", "text/markdown", "text/latex"],
@@ -16,7 +18,7 @@ ResultMimeType = Union[
 @dataclass
 class Plugin:
     name: str
-    package: str
+    package: bytes
     config: dict[str, str] | None
     loaded: bool = False
 
@@ -95,4 +97,4 @@ class Session:
     execution_count: int = 0
     execution_dict: dict[str, ExecutionResultInternal] = field(default_factory=dict)
 
-    client: BlockingKernelClient | None = None
+    client: "AsyncKernelClient | None" = None
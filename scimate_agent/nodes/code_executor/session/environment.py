@@ -1,17 +1,10 @@
 import asyncio
-import base64
 import json
 import os
-import site
-import sys
 from ast import literal_eval
 from typing import Any, Callable, Literal, Union, TYPE_CHECKING
 
 import structlog
-from jupyter_client.asynchronous.client import AsyncKernelClient
-from jupyter_client.kernelspec import KernelSpec, KernelSpecManager
-from jupyter_client.manager import KernelManager
-from jupyter_client.multikernelmanager import MultiKernelManager
 
 from ..utils import get_id, time_usage
 from .common import (
@@ -26,50 +19,23 @@ from .common import (
 )
 
 if TYPE_CHECKING:
+    from jupyter_client.asynchronous.client import AsyncKernelClient
     from structlog.stdlib import BoundLogger
 
 logger: "BoundLogger" = structlog.get_logger()
 
 
-class KernelSpecProvider(KernelSpecManager):
-    def get_kernel_spec(self, kernel_name: str) -> KernelSpec:
-        if kernel_name == "scimate":
-            return KernelSpec(
-                argv=[
-                    "python",
-                    "-m",
-                    "scimate_agent.nodes.code_executor.kernel.launcher",
-                    "-f",
-                    "{connection_file}",
-                ],
-                display_name="SciMate",
-                language="python",
-                metadata={"debugger": True},
-            )
-        return super().get_kernel_spec(kernel_name)
-
-
-class SciMateMultiKernelManager(MultiKernelManager):
-    def pre_start_kernel(
-        self,
-        kernel_name: str | None,
-        kwargs: Any,
-    ) -> tuple[KernelManager, str, str]:
-        env: dict[str, str] | None = kwargs.get("env", None)
-
-        km, kernel_name, kernel_id = super().pre_start_kernel(kernel_name, kwargs)
-        if env is not None:
-            if "CONNECTION_FILE" in env:
-                km.connection_file = env["CONNECTION_FILE"]
-        return km, kernel_name, kernel_id
-
-
 class Environment:
     def __init__(self, env_id: str, env_dir: str) -> None:
         self.env_id = env_id
         self.env_dir = env_dir
 
         self.session_dict: dict[str, Session] = {}
+        # Directories already created by this environment, to skip repeated `makedirs` calls
+        self._known_dirs: set[str] = set()
+
+        # Defer importing jupyter_client until an environment is actually created
+        from .kernel import KernelSpecProvider, SciMateMultiKernelManager
 
         self.kernel_manager = SciMateMultiKernelManager(
             default_kernel_name="scimate",
@@ -78,7 +44,7 @@ class Environment:
 
     def get_default_session_dir(self, session_id: str) -> str:
         session_dir = os.path.join(self.env_dir, "sessions", session_id)
-        os.makedirs(session_dir, exist_ok=True)
+        self._makedirs(session_dir)
         return session_dir
 
     async def start_session(
@@ -87,12 +53,15 @@ class Environment:
         session_dir: str | None = None,
         cwd: str | None = None,
     ) -> None:
+        import site
+        import sys
+
         session = self._get_session(session_id, session_dir, cwd)
         session_dir = os.path.realpath(session.session_dir)
         cwd = os.path.realpath(session.cwd)
 
         kernel_session_dir = os.path.join(session_dir, "kernel")
-        os.makedirs(kernel_session_dir, exist_ok=True)
+        self._makedirs(kernel_session_dir)
 
         new_kernel_id = get_id(prefix="knl")
 
@@ -152,6 +121,40 @@ class Environment:
 
         session.kernel_status = "stopped"
 
+    async def reset_session(self, session_id: str) -> None:
+        session = self._get_session(session_id)
+        if session is None:
+            raise ValueError(f"Session {session_id} not found")
+
+        is_alive = False
+        if session.kernel_status == "ready" and session.kernel_id is not None:
+            kernel = self.kernel_manager.get_kernel(session.kernel_id)
+            is_alive = await kernel._async_is_alive()
+
+        if not is_alive:
+            # Fall back to a real restart if the kernel is not responsive.
+            # The new kernel has none of the plugins loaded.
+            session.plugins.clear()
+            await self.stop_session(session_id)
+            await self.start_session(session_id, session.session_dir, session.cwd)
+            return
+
+        # Reuse the running kernel, clearing its state instead of restarting it
+        for plugin in session.plugins.values():
+            if plugin.loaded:
+                await self._cmd_unload_plugin(session, plugin)
+        session.plugins.clear()
+
+        await self._execute_code_on_kernel(
+            session_id=session_id,
+            exec_id=get_id(prefix="ctl"),
+            code="%reset -f -s",
+            silent=True,
+            store_history=False,
+            exec_type="control",
+        )
+        await self._cmd_session_init(session)
+
     def update_session_vars(self, session_id: str, vars: dict[str, str]) -> None:
         session = self._get_session(session_id)
         if session is None:
@@ -211,12 +214,9 @@ class Environment:
                 await self._cmd_unload_plugin(session, prev_plugin)
             del session.plugins[plugin_name]
 
-        package_bytes = plugin_loader()
-        package_str = base64.b64encode(package_bytes).decode("utf-8")
-
         plugin = Plugin(
             name=plugin_name,
-            package=package_str,
+            package=plugin_loader(),
             config=plugin_config,
         )
         await self._cmd_load_plugin(session, plugin)
@@ -280,12 +280,17 @@ class Environment:
                 session_dir=session_dir,
                 cwd=cwd,
             )
-            os.makedirs(new_session.session_dir, exist_ok=True)
-            os.makedirs(new_session.cwd, exist_ok=True)
+            self._makedirs(new_session.session_dir)
+            self._makedirs(new_session.cwd)
             self.session_dict[session_id] = new_session
 
         return self.session_dict.get(session_id, None)
 
+    def _makedirs(self, path: str) -> None:
+        if path not in self._known_dirs:
+            os.makedirs(path, exist_ok=True)
+            self._known_dirs.add(path)
+
     def _get_connection_file(self, session_id: str, kernel_id: str) -> str:
         return os.path.join(
             self._get_session(session_id).session_dir,
@@ -293,15 +298,19 @@ class Environment:
             f"conn-{session_id}-{kernel_id}.json",
         )
 
-    async def _get_client(self, session_id: str) -> AsyncKernelClient:
+    async def _get_client(self, session_id: str) -> "AsyncKernelClient":
+        from jupyter_client.asynchronous.client import AsyncKernelClient
+
         session = self._get_session(session_id)
         if session is None:
             raise ValueError(f"Session {session_id} not found")
 
         if session.client is None:
-            connection_file = self._get_connection_file(session_id, session.kernel_id)
-            client = AsyncKernelClient(connection_file=connection_file)
-            client.load_connection_file()
+            # Load the connection info from the kernel manager instead of the connection file.
+            # It is the same info the kernel got, since the ports are not reassigned at launch.
+            kernel = self.kernel_manager.get_kernel(session.kernel_id)
+            client = AsyncKernelClient()
+            client.load_connection_info(kernel.get_connection_info())
 
             await client.wait_for_ready(timeout=30)
             client.start_channels()
@@ -327,95 +336,119 @@ class Environment:
         silent: bool = False,
         store_history: bool = True,
         exec_type: ExecType = "user",
+        buffers: list[bytes] | None = None,
     ) -> ExecutionResultInternal:
         exec_result = ExecutionResultInternal(exec_id=exec_id, code=code, exec_type=exec_type)
 
         client = await self._get_client(session_id)
 
         def execute():
-            return client.execute(
-                code,
-                silent=silent,
-                store_history=store_history,
-                allow_stdin=False,
-                stop_on_error=True,
+            if buffers is None:
+                return client.execute(
+                    code,
+                    silent=silent,
+                    store_history=store_history,
+                    allow_stdin=False,
+                    stop_on_error=True,
+                )
+
+            # `client.execute` does not support buffers, so build the request manually.
+            # The buffers are sent as raw ZMQ frames, available to the kernel via the parent message.
+            msg = client.session.msg(
+                "execute_request",
+                {
+                    "code": code,
+                    "silent": silent,
+                    "store_history": store_history,
+                    "user_expressions": {},
+                    "allow_stdin": False,
+                    "stop_on_error": True,
+                },
             )
+            client.session.send(client.shell_channel.socket, msg, buffers=buffers)
+            return msg["header"]["msg_id"]
 
         result_msg_id = await asyncio.to_thread(execute)
 
         try:
             # TODO: interrupt kernel if it takes too long
-            while True:
+            is_idle = False
+            while not is_idle:
                 with time_usage() as time_msg:
                     message = await client.get_iopub_msg(timeout=180)
+                    # Drain all the messages that are already available in one go
+                    messages = [message] + await client.iopub_channel.get_msgs()
                 await logger.adebug(
-                    "Kernel message",
+                    "Kernel messages",
                     time=time_msg.total,
-                    message=message,
+                    num_messages=len(messages),
                     code=code,
                 )
 
-                if message["parent_header"]["msg_id"] != result_msg_id:
-                    # skip messages not related to the current execution
-                    continue
-                msg_type = message["msg_type"]
-                if msg_type == "status":
-                    if message["content"]["execution_state"] == "idle":
+                for message in messages:
+                    if message["parent_header"]["msg_id"] != result_msg_id:
+                        # skip messages not related to the current execution
+                        continue
+                    is_idle = await self._handle_iopub_message(exec_result, message)
+                    if is_idle:
                         break
-                elif msg_type == "stream":
-                    stream_name = message["content"]["name"]
-                    stream_text = message["content"]["text"]
-                    if stream_name == "stdout":
-                        exec_result.stdout.append(stream_text)
-                    elif stream_name == "stderr":
-                        exec_result.stderr.append(stream_text)
-                    else:
-                        await logger.awarning("Unknown stream name", stream_name=stream_name)
-                elif msg_type == "execute_result":
-                    exec_result.result = message["content"]["data"]
-                elif msg_type == "error":
-                    error_traceback_lines = message["content"]["traceback"]
-                    if error_traceback_lines is None:
-                        error_name = message["content"]["ename"]
-                        error_value = message["content"]["evalue"]
-                        error_traceback_lines = [f"{error_name}: {error_value}"]
-                    error_traceback = "\n".join(error_traceback_lines)
-                    exec_result.error = error_traceback
-                elif msg_type == "display_data":
-                    data: dict[ResultMimeType, Any] = message["content"]["data"]
-                    metadata: dict[str, Any] = message["content"]["metadata"]
-                    transient: dict[str, Any] = message["content"]["transient"]
-                    exec_result.displays.append(
-                        DisplayData(
-                            data=data,
-                            metadata=metadata,
-                            transient=transient,
-                        )
-                    )
-                elif msg_type == "update_display_data":
-                    data: dict[ResultMimeType, Any] = message["content"]["data"]
-                    metadata: dict[str, Any] = message["content"]["metadata"]
-                    transient: dict[str, Any] = message["content"]["transient"]
-                    exec_result.displays.append(
-                        DisplayData(
-                            data=data,
-                            metadata=metadata,
-                            transient=transient,
-                        )
-                    )
-                else:
-                    await logger.adebug("Unhandled message type", msg_type=msg_type)
         finally:
             ...
 
         return exec_result
 
+    async def _handle_iopub_message(
+        self,
+        exec_result: ExecutionResultInternal,
+        message: dict[str, Any],
+    ) -> bool:
+        """Handle an iopub message of the execution, returns whether the kernel is idle."""
+
+        msg_type = message["msg_type"]
+        if msg_type == "status":
+            if message["content"]["execution_state"] == "idle":
+                return True
+        elif msg_type == "stream":
+            stream_name = message["content"]["name"]
+            stream_text = message["content"]["text"]
+            if stream_name == "stdout":
+                exec_result.stdout.append(stream_text)
+            elif stream_name == "stderr":
+                exec_result.stderr.append(stream_text)
+            else:
+                await logger.awarning("Unknown stream name", stream_name=stream_name)
+        elif msg_type == "execute_result":
+            exec_result.result = message["content"]["data"]
+        elif msg_type == "error":
+            error_traceback_lines = message["content"]["traceback"]
+            if error_traceback_lines is None:
+                error_name = message["content"]["ename"]
+                error_value = message["content"]["evalue"]
+                error_traceback_lines = [f"{error_name}: {error_value}"]
+            error_traceback = "\n".join(error_traceback_lines)
+            exec_result.error = error_traceback
+        elif msg_type in ("display_data", "update_display_data"):
+            data: dict[ResultMimeType, Any] = message["content"]["data"]
+            metadata: dict[str, Any] = message["content"]["metadata"]
+            transient: dict[str, Any] = message["content"]["transient"]
+            exec_result.displays.append(
+                DisplayData(
+                    data=data,
+                    metadata=metadata,
+                    transient=transient,
+                )
+            )
+        else:
+            await logger.adebug("Unhandled message type", msg_type=msg_type)
+        return False
+
     async def _execute_control_code_on_kernel(
         self,
         session_id: str,
         code: str,
         silent: bool = False,
         store_history: bool = False,
+        buffers: list[bytes] | None = None,
     ) -> dict[Literal["is_success", "message", "data"], Union[bool, str, Any]]:
         exec_result = await self._execute_code_on_kernel(
             session_id=session_id,
@@ -424,12 +457,13 @@ class Environment:
             silent=silent,
             store_history=store_history,
             exec_type="control",
+            buffers=buffers,
         )
         if exec_result.error is not None:
             raise Exception(exec_result.error)
         if exec_result.result is None or "text/plain" not in exec_result.result:
             raise Exception("No text output returned from control code.")
-        result = literal_eval(exec_result.result["text/plain"])
+        result = json.loads(exec_result.result["text/plain"])
         if not result["is_success"]:
             raise Exception(result["message"])
         return result
@@ -449,11 +483,11 @@ class Environment:
     async def _cmd_load_plugin(self, session: Session, plugin: Plugin) -> None:
         await self._execute_control_code_on_kernel(
             session_id=session.session_id,
-            code=f"%%_scimate_register_plugin {plugin.name}\n{plugin.package}",
-        )
-        await self._execute_control_code_on_kernel(
-            session_id=session.session_id,
-            code=f"%%_scimate_configure_plugin {plugin.name}\n{json.dumps(plugin.config or {})}",
+            code=(
+                f"%%_scimate_register_and_configure_plugin {plugin.name}\n"
+                f"{json.dumps(plugin.config or {})}"
+            ),
+            buffers=[plugin.package],
         )
 
     async def _cmd_test_plugin(self, session: Session, plugin: Plugin) -> None:
@@ -487,19 +521,21 @@ class Environment:
             artifacts=[],
         )
 
-        for mime_type in exec_result.result.keys():
+        for mime_type, text_result in exec_result.result.items():
             if mime_type.startswith("text/"):
                 assert result.output is None, (
                     "Internal error: exec_result.result contains multiple text/plain outputs:"
                     f" {exec_result.result}"
                 )
-                text_result = exec_result.result[mime_type]
                 try:
-                    parsed_result = literal_eval(text_result)
-                    # Filter out the `Ellipsis` object, which cannot be JSON serialized
-                    parsed_result = filter_ellipsis(parsed_result)
-                except:
-                    parsed_result = text_result
+                    parsed_result = json.loads(text_result)
+                except ValueError:
+                    try:
+                        parsed_result = literal_eval(text_result)
+                        # Filter out the `Ellipsis` object, which cannot be JSON serialized
+                        parsed_result = filter_ellipsis(parsed_result)
+                    except:
+                        parsed_result = text_result
                 result.output = parsed_result
 
         display_artifact_count = 0
@@ -508,30 +544,27 @@ class Environment:
             artifact = ExecutionArtifact(
                 name=f"{exec_result.exec_id}-display-{display_artifact_count}"
             )
-            has_svg = False
-            has_pic = False
-            for mime_type in display.data.keys():
+
+            # Prefer SVG over other image types, and keep the first image found otherwise
+            image_mime_type = None
+            for mime_type, content in display.data.items():
                 if mime_type.startswith("image/"):
                     if mime_type == "image/svg+xml":
-                        if has_pic and has_svg:
-                            continue
-                        has_svg = True
-                        has_pic = True
-                        artifact.type = "svg"
-                        artifact.file_content_encoding = "str"
-                    else:
-                        if has_pic:
-                            continue
-                        has_pic = True
-                        artifact.type = "image"
-                        artifact.file_content_encoding = "base64"
-
-                    artifact.mime_type = mime_type
-                    artifact.file_content = display.data[mime_type]
+                        image_mime_type = mime_type
+                    elif image_mime_type is None:
+                        image_mime_type = mime_type
                 elif mime_type.startswith("text/"):
-                    artifact.preview = display.data[mime_type]
+                    artifact.preview = content
 
-            if has_pic:
+            if image_mime_type is not None:
+                if image_mime_type == "image/svg+xml":
+                    artifact.type = "svg"
+                    artifact.file_content_encoding = "str"
+                else:
+                    artifact.type = "image"
+                    artifact.file_content_encoding = "base64"
+                artifact.mime_type = image_mime_type
+                artifact.file_content = display.data[image_mime_type]
                 result.artifacts.append(artifact)
 
         if isinstance(extra_result, dict):
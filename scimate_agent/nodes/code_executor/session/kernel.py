@@ -0,0 +1,52 @@
+import json
+from typing import Any
+
+from jupyter_client.kernelspec import KernelSpec, KernelSpecManager
+from jupyter_client.manager import KernelManager
+from jupyter_client.multikernelmanager import MultiKernelManager
+
+
+class KernelSpecProvider(KernelSpecManager):
+    def get_kernel_spec(self, kernel_name: str) -> KernelSpec:
+        if kernel_name == "scimate":
+            return KernelSpec(
+                argv=[
+                    "python",
+                    "-m",
+                    "scimate_agent.nodes.code_executor.kernel.launcher",
+                    "-f",
+                    "{connection_file}",
+                ],
+                display_name="SciMate",
+                language="python",
+                metadata={"debugger": True},
+            )
+        return super().get_kernel_spec(kernel_name)
+
+
+class SciMateMultiKernelManager(MultiKernelManager):
+    def pre_start_kernel(
+        self,
+        kernel_name: str | None,
+        kwargs: Any,
+    ) -> tuple[KernelManager, str, str]:
+        env: dict[str, str] | None = kwargs.get("env", None)
+
+        km, kernel_name, kernel_id = super().pre_start_kernel(kernel_name, kwargs)
+        if env is not None:
+            if "CONNECTION_FILE" in env:
+                km.connection_file = env["CONNECTION_FILE"]
+
+            # Allocate the ports now and pass the connection info to the kernel launcher
+            # through the environment, so that the kernel does not need to read it from disk.
+            # Writing the connection file is what allocates the ports. The file is kept as the
+            # fallback of the launcher when the environment variable is missing, and the
+            # provisioner skips writing it again once it is written.
+            # Port caching must be off, otherwise the provisioner assigns new ports to the
+            # kernel manager in `pre_launch`, and the clients would not match the kernel.
+            km.cache_ports = False
+            km.write_connection_file()
+            conn_info = km.get_connection_info()
+            conn_info["key"] = conn_info["key"].decode("utf-8")
+            env["SCIMATE_CONN_INFO_JSON"] = json.dumps(conn_info)
+        return km, kernel_name, kernel_id
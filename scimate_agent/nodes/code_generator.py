@@ -1,14 +1,18 @@
+import json
+import re
 from functools import lru_cache
-from typing import Any, Literal
+from typing import TYPE_CHECKING, Literal
 
-from langchain_core.load import load as lc_load
+from langchain_core.load import dumps as lc_dumps
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
-    ToolMessage,
+    message_chunk_to_message,
 )
+from langchain_core.outputs import ChatGeneration
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END
 from pydantic import BaseModel, Field
@@ -26,9 +30,36 @@ from scimate_agent.state import (
     RoundUpdate,
 )
 from scimate_agent.utils.env import get_env_context
+from scimate_agent.utils.http import get_shared_async_http_client
+from scimate_agent.utils.llm_cache import HashedInMemoryCache
+
+if TYPE_CHECKING:
+    import httpx
 
 ROLE_NAME = "CodeGenerator"
 
+LLM_CACHE_MAXSIZE = 1024
+
+# Prompt templates, loaded once at import time
+SYSTEM_MESSAGE_TEMPLATE = get_prompt_template("code_generator_system_message")
+CONV_HEAD_TEMPLATE = get_prompt_template("code_generator_conv_head")
+USER_MESSAGE_TEMPLATE = get_prompt_template("code_generator_user_message")
+REQUIREMENTS_TEMPLATE = get_prompt_template("code_generator_requirements")
+HISTORY_SUMMARY_TEMPLATE = get_prompt_template("code_generator_history_summary")
+
+MAX_SELF_CORRECTIONS = 3
+MAX_INLINE_RETRIES = 2
+
+# (send_from, send_to) of the posts that can carry feedback
+VALID_FEEDBACK_EDGES = frozenset(
+    {
+        ("Reviser", "CodeGenerator"),
+        ("CodeVerifier", "CodeGenerator"),
+        ("CodeExecutor", "CodeGenerator"),
+        ("CodeExecutor", "Planner"),
+    }
+)
+
 
 class CodeGenerationResult(BaseModel):
     thought: str = Field(description="The thoughts before generating the code.")
@@ -69,322 +100,531 @@ class CodeGenerationResult(BaseModel):
         )
 
 
+# Derived once, the schema is embedded in the system message
+CODE_GENERATION_RESULT_SCHEMA = json.dumps(CodeGenerationResult.model_json_schema())
+
+
 class Example(BaseModel):
     rounds: list[Round]
     plugins: list[str]
 
 
-@lru_cache
-def _get_code_generator_llm(llm_vendor: str, llm_model: str, llm_temperature: float):
+@lru_cache(maxsize=1)
+def _get_code_generator_llm_cache() -> HashedInMemoryCache:
+    # Shared by the LLM clients of all event loops, the entries are keyed by the model parameters
+    return HashedInMemoryCache(maxsize=LLM_CACHE_MAXSIZE)
+
+
+def get_code_generator_llm_cache(config: AgentConfig) -> tuple[HashedInMemoryCache, str] | None:
+    """Returns the response cache and the key of the model parameters, if the replies are cached.
+
+    Identical prompts are answered from the cache only when the output is deterministic.
+    """
+    if config.llm_temperature != 0.0:
+        return None
+    return _get_code_generator_llm_cache(), f"{config.llm_vendor}:{config.llm_model}"
+
+
+@lru_cache(maxsize=8)
+def _get_code_generator_llm(
+    llm_vendor: str,
+    llm_model: str,
+    llm_temperature: float,
+    http_async_client: "httpx.AsyncClient",
+):
     if llm_vendor == "openai":
         from langchain_openai import ChatOpenAI
 
-        llm = ChatOpenAI(model=llm_model, temperature=llm_temperature)
+        llm = ChatOpenAI(
+            model=llm_model,
+            temperature=llm_temperature,
+            http_async_client=http_async_client,
+        )
+        llm = llm.bind(response_format={"type": "json_object"})
     elif llm_vendor == "anthropic":
         from langchain_anthropic import ChatAnthropic
 
+        # `ChatAnthropic` does not take a shared HTTP client, it keeps its own
         llm = ChatAnthropic(model=llm_model, temperature=llm_temperature)
     else:
         raise ValueError(f"Unsupported LLM vendor: {llm_vendor}")
 
-    return llm.with_structured_output(CodeGenerationResult, include_raw=True)
+    # The result is requested as a JSON object in the system message and parsed by
+    # `parse_code_generation_result`, instead of going through `with_structured_output`.
+    return llm
+
+
+def get_message_text(message: AIMessage | AIMessageChunk) -> str:
+    if isinstance(message.content, str):
+        return message.content
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in message.content
+    )
+
+
+_TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+
+
+def try_local_repair(content: str) -> CodeGenerationResult | None:
+    """Tries to fix the common JSON glitches of the LLM, e.g., stray text around the object,
+    raw newlines in the strings and trailing commas. Returns `None` if it cannot be repaired."""
+
+    start, end = content.find("{"), content.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    content = content[start : end + 1]
+
+    for candidate in (content, _TRAILING_COMMA_RE.sub(r"\1", content)):
+        try:
+            # `strict=False` allows control characters (e.g., newlines) inside the strings
+            data = json.loads(candidate, strict=False)
+            return CodeGenerationResult.model_validate(data)
+        except ValueError:
+            continue
+
+    return None
+
+
+def parse_code_generation_result(
+    raw_message: AIMessage,
+) -> tuple[CodeGenerationResult, ValueError | None]:
+    content = get_message_text(raw_message).strip()
+    # Tolerate the JSON object wrapped in a markdown code block
+    if content.startswith("```"):
+        content = content.strip("`").removeprefix("json").strip()
+
+    try:
+        return CodeGenerationResult.model_validate_json(content), None
+    except ValueError as e:
+        cg_result = try_local_repair(content)
+        if cg_result is not None:
+            # Repaired locally, no need to ask the LLM to revise it
+            return cg_result, None
+        # Keep the raw reply, so that it can be revised
+        return CodeGenerationResult(thought="", reply_type="text", reply_content=content), e
+
+
+@lru_cache(maxsize=8)
+def _get_history_summary_llm(
+    llm_vendor: str,
+    llm_model: str,
+    http_async_client: "httpx.AsyncClient",
+):
+    if llm_vendor == "openai":
+        from langchain_openai import ChatOpenAI
+
+        llm = ChatOpenAI(
+            model=llm_model,
+            temperature=0.0,
+            http_async_client=http_async_client,
+        )
+    elif llm_vendor == "anthropic":
+        from langchain_anthropic import ChatAnthropic
+
+        # `ChatAnthropic` does not take a shared HTTP client, it keeps its own
+        llm = ChatAnthropic(model=llm_model, temperature=0.0)
+    else:
+        raise ValueError(f"Unsupported LLM vendor: {llm_vendor}")
+
+    return llm
+
+
+def get_history_summary_llm(config: AgentConfig):
+    return _get_history_summary_llm(
+        config.llm_vendor,
+        config.history_summary_llm_model or config.llm_model,
+        get_shared_async_http_client(),
+    )
 
 
 def get_code_generator_llm(config: AgentConfig):
+    # The HTTP client is per event loop, so are the LLM clients using it
     return _get_code_generator_llm(
         config.llm_vendor,
         config.llm_model,
         config.llm_temperature,
+        get_shared_async_http_client(),
     )
 
 
+def _last_attachment(post: Post, attachment_type: AttachmentType) -> Attachment | None:
+    attachments = post.get_attachments(attachment_type)
+    return attachments[-1] if attachments else None
+
+
 def format_feedback(post: Post | None) -> str:
     if post is None:
         return "None"
 
-    assert (post.send_from, post.send_to) in [
-        ("Reviser", "CodeGenerator"),
-        ("CodeVerifier", "CodeGenerator"),
-        ("CodeExecutor", "CodeGenerator"),
-        ("CodeExecutor", "Planner"),
-    ], f"Invalid post: {post.send_from} -> {post.send_to}"
-
-    feedback_items: dict[str, Attachment] = {}
-
-    for attachment in reversed(post.attachments):
-        if len(feedback_items) >= 2:
-            break
+    assert (post.send_from, post.send_to) in VALID_FEEDBACK_EDGES, (
+        f"Invalid post: {post.send_from} -> {post.send_to}"
+    )
 
-        if attachment.type == AttachmentType.CODE_VERIFICATION_RESULT:
-            if "verification_result" not in feedback_items:
-                feedback_items["verification_result"] = attachment
-        elif attachment.type == AttachmentType.CODE_EXECUTION_RESULT:
-            if "execution_result" not in feedback_items:
-                feedback_items["execution_result"] = attachment
+    # The last attachment of each type wins
+    verification_attachment = _last_attachment(post, AttachmentType.CODE_VERIFICATION_RESULT)
+    execution_attachment = _last_attachment(post, AttachmentType.CODE_EXECUTION_RESULT)
 
-    feedback = ""
-    if "verification_result" in feedback_items:
-        verification_result = feedback_items["verification_result"].extra
+    feedback: list[str] = []
+    if verification_attachment is not None:
+        verification_result = verification_attachment.extra
         if verification_result is not None:
             assert isinstance(verification_result, list), "Verification result must be a list."
-            error_msg = "\n".join(verification_result)
-            feedback += f"## Verification\nCode verification detected the following issues:\n{error_msg}\n"
+            feedback.append("## Verification\nCode verification detected the following issues:\n")
+            feedback.append("\n".join(verification_result))
+            feedback.append("\n")
         else:
-            feedback += f"## Verification\nCode verification has been passed.\n"
+            feedback.append("## Verification\nCode verification has been passed.\n")
 
-    if "execution_result" in feedback_items:
-        execution_result = feedback_items["execution_result"]
-        if isinstance(execution_result.extra, dict):
-            is_success = execution_result.extra.get("is_success", False)
+    if execution_attachment is not None:
+        execution_result = execution_attachment.extra
+        if isinstance(execution_result, dict):
+            is_success = execution_result.get("is_success", False)
         else:
-            is_success = execution_result.extra.is_success
+            is_success = execution_result.is_success
 
         if is_success:
-            feedback += f"## Execution\nThe code has been executed successfully with the following result:\n"
-        else:
-            feedback += f"## Execution\nThe code has failed to execute with the following error:\n"
-        feedback += f"{execution_result.content}\n"
-
-    if feedback == "":
-        feedback = "None"
-
-    return feedback
-
-
-def format_code_generation_requirements(role_name: str, agent_config: AgentConfig) -> str:
-    allowed_modules = agent_config.allowed_modules
-    blocked_modules = agent_config.blocked_modules
-    allowed_functions = agent_config.allowed_functions
-    blocked_functions = agent_config.blocked_functions
-    allowed_variables = agent_config.allowed_variables
-    blocked_variables = agent_config.blocked_variables
-
-    requirements: list[str] = []
-
-    if allowed_modules is not None:
-        if len(allowed_modules) > 0:
-            requirements.append(
-                f"- {role_name} can only import the following Python modules: "
-                + ", ".join([f"{module}" for module in allowed_modules]),
+            feedback.append(
+                "## Execution\nThe code has been executed successfully with the following result:\n"
             )
         else:
-            requirements.append(f"- {role_name} cannot import any Python modules.")
-
-    if blocked_modules is not None:
-        if len(blocked_modules) > 0:
-            requirements.append(
-                f"- {role_name} cannot use the following Python modules: "
-                + ", ".join([f"{module}" for module in blocked_modules]),
+            feedback.append(
+                "## Execution\nThe code has failed to execute with the following error:\n"
             )
+        feedback.append(execution_attachment.content)
+        feedback.append("\n")
 
-    if allowed_functions is not None:
-        if len(allowed_functions) > 0:
-            requirements.append(
-                f"- {role_name} can only use the following Python functions: "
-                + ", ".join([f"{func}" for func in allowed_functions]),
-            )
-        else:
-            requirements.append(f"- {role_name} cannot use any Python functions.")
+    return "".join(feedback) or "None"
 
-    if blocked_functions is not None:
-        if len(blocked_functions) > 0:
-            requirements.append(
-                f"- {role_name} cannot use the following Python functions: "
-                + ", ".join([f"{func}" for func in blocked_functions]),
-            )
 
-    if allowed_variables is not None:
-        if len(allowed_variables) > 0:
-            requirements.append(
-                f"- {role_name} can only use the following variables: "
-                + ", ".join([f"{var}" for var in allowed_variables]),
-            )
-        else:
-            requirements.append(f"- {role_name} cannot use any variables.")
+def format_plan_enrichment(post: Post) -> str:
+    plan_enrichments = [a.content for a in post.get_attachments(AttachmentType.PLAN_ENRICHMENT)]
+    if len(plan_enrichments) == 0:
+        return ""
+    return "Additional context:\n" + "\n".join(plan_enrichments) + "\n\n"
 
-    if blocked_variables is not None:
-        if len(blocked_variables) > 0:
-            requirements.append(
-                f"- {role_name} cannot use the following variables: "
-                + ", ".join([f"{var}" for var in blocked_variables]),
-            )
 
-    return "\n".join(requirements)
+@lru_cache(maxsize=256)
+def format_conversation_head(summary: str, plugins_prompt: str) -> str:
+    return CONV_HEAD_TEMPLATE.format(
+        SUMMARY=summary,
+        PLUGINS=plugins_prompt,
+        ROLE_NAME=ROLE_NAME,
+    )
 
 
 def format_conversation(
     rounds: list[Round],
     agent_config: AgentConfig,
     plugins: list[PluginEntry] | None = None,
-    add_requirements: bool = False,
     summary: str | None = None,
 ):
     messages = []
 
-    conv_prefix = get_prompt_template("code_generator_conv_head").format(
-        SUMMARY=summary if summary is not None else "None",
-        PLUGINS="\n".join([p.format_prompt() for p in plugins]) if plugins else "None",
-        ROLE_NAME=ROLE_NAME,
+    conv_prefix = format_conversation_head(
+        summary if summary is not None else "None",
+        "\n".join([p.format_prompt() for p in plugins]) if plugins else "None",
     )
 
+    flat_posts = [(round, post) for round in rounds for post in round.posts]
+    final_idx = len(flat_posts) - 1
+
     last_post = None
-    for rnd_idx, round in enumerate(rounds):
-        for post_idx, post in enumerate(round.posts):
-            is_first_post = rnd_idx == 0 and post_idx == 0
-            is_final_post = rnd_idx == len(rounds) - 1 and post_idx == len(round.posts) - 1
-
-            if post.send_from == "Planner" and post.send_to == "CodeGenerator":
-                if is_final_post:
-                    enrichment = f"The user request is: {round.user_query}\n\n"
-
-                    plan_enrichments = post.get_attachments(AttachmentType.PLAN_ENRICHMENT)
-                    if len(plan_enrichments) > 0:
-                        enrichment += "Additional context:\n" + "\n".join(
-                            [e.content for e in plan_enrichments]
-                        ) + "\n\n"
-                else:
-                    enrichment = ""
-
-                if is_first_post:
-                    message = conv_prefix + "\n"
-                else:
-                    message = ""
-
-                feedback = "None"
-                if last_post is not None:
-                    feedback = format_feedback(last_post)
-
-                message += get_prompt_template("code_generator_user_message").format(
-                    FEEDBACK=feedback,
-                    MESSAGE=f"{enrichment}The task for this specific step is: {post.message}",
+    for idx, (round, post) in enumerate(flat_posts):
+        is_first_post = idx == 0
+        is_final_post = idx == final_idx
+
+        # The Planner's post carries the feedback of the last post
+        last_feedback = "None"
+        if post.send_from == "Planner" and last_post is not None:
+            last_feedback = format_feedback(last_post)
+
+        # The user message of a post only depends on the post itself, its position and the
+        # feedback of the last post, so it is reused across calls when they are unchanged.
+        message_key = (conv_prefix if is_first_post else None, is_final_post, last_feedback)
+        cached_message = post.get_formatted_message(message_key)
+        if cached_message is not None:
+            messages.append(cached_message)
+            last_post = post
+            continue
+
+        # Parts of the user message for this post, if any
+        parts: list[str] | None = None
+
+        if post.send_from == "Planner" and post.send_to == "CodeGenerator":
+            if is_final_post:
+                enrichment = (
+                    f"The user request is: {round.user_query}\n\n" + format_plan_enrichment(post)
                 )
+            else:
+                # Only the final post carries the plan enrichment
+                enrichment = ""
 
-                if is_final_post and add_requirements:
-                    message += "\n\n" + get_prompt_template("code_generator_requirements").format(
-                        ROLE_NAME=ROLE_NAME,
-                        CODE_GENERATION_REQUIREMENTS=format_code_generation_requirements(
-                            ROLE_NAME, agent_config
-                        ),
-                    )
+            parts = []
+            if is_first_post:
+                parts.append(conv_prefix)
+                parts.append("\n")
 
-                messages.append(HumanMessage(content=message))
-            elif post.send_from == "Reviser" and post.send_to == "CodeGenerator":
-                # Self-correction
-                assert not is_first_post, "Reviser should not be the first post."
+            parts.append(
+                USER_MESSAGE_TEMPLATE.format(
+                    FEEDBACK=last_feedback,
+                    MESSAGE=f"{enrichment}The task for this specific step is: {post.message}",
+                )
+            )
+        elif post.send_from == "Reviser" and post.send_to == "CodeGenerator":
+            # Self-correction
+            assert not is_first_post, "Reviser should not be the first post."
 
-                message = get_prompt_template("code_generator_user_message").format(
+            parts = [
+                USER_MESSAGE_TEMPLATE.format(
                     FEEDBACK=format_feedback(post),
                     MESSAGE=post.message,  # revise message
                 )
+            ]
+        elif post.send_from in ["CodeVerifier", "CodeExecutor"] and post.send_to == "CodeGenerator":
+            # Self-correction
+            assert not is_first_post, "CodeVerifier and CodeExecutor should not be the first post."
+
+            if post.send_from == "CodeVerifier":
+                message = (
+                    "The generated code has been verified and some errors are found. "
+                    "If you think you can fix the problem by rewriting the code, "
+                    "please do it and try again.\n"
+                    "Otherwise, please explain the problem to me."
+                )
+            else:
+                message = (
+                    "The execution of the previous generated code has failed. "
+                    "If you think you can fix the problem by rewriting the code, "
+                    "please generate code and run it again.\n"
+                    "Otherwise, please explain the problem to me."
+                )
 
-                if is_final_post and add_requirements:
-                    message += "\n\n" + get_prompt_template("code_generator_requirements").format(
-                        ROLE_NAME=ROLE_NAME,
-                        CODE_GENERATION_REQUIREMENTS=format_code_generation_requirements(
-                            ROLE_NAME, agent_config
-                        ),
-                    )
-
-                messages.append(HumanMessage(content=message))
-            elif post.send_from in ["CodeVerifier", "CodeExecutor"] and post.send_to == "CodeGenerator":
-                # Self-correction
-                assert not is_first_post, "CodeVerifier and CodeExecutor should not be the first post."
-
-                if post.send_from == "CodeVerifier":
-                    message = (
-                        "The generated code has been verified and some errors are found. "
-                        "If you think you can fix the problem by rewriting the code, "
-                        "please do it and try again.\n"
-                        "Otherwise, please explain the problem to me."
-                    )
-                else:
-                    message = (
-                        "The execution of the previous generated code has failed. "
-                        "If you think you can fix the problem by rewriting the code, "
-                        "please generate code and run it again.\n"
-                        "Otherwise, please explain the problem to me."
-                    )
-
-                message = get_prompt_template("code_generator_user_message").format(
+            parts = [
+                USER_MESSAGE_TEMPLATE.format(
                     FEEDBACK=format_feedback(post),
                     MESSAGE=message,
                 )
-
-                if is_final_post and add_requirements:
-                    message += "\n\n" + get_prompt_template("code_generator_requirements").format(
-                        ROLE_NAME=ROLE_NAME,
-                        CODE_GENERATION_REQUIREMENTS=format_code_generation_requirements(
-                            ROLE_NAME, agent_config
-                        ),
-                    )
-
+            ]
+        elif post.send_from == "CodeGenerator" and post.send_to in [
+            "CodeVerifier",
+            "Planner",
+            "Reviser",
+        ]:
+            assert post.original_messages is not None, "Original messages are required."
+            messages += post.get_original_messages()
+
+            if is_final_post:
+                # This human message is added only for examples and context summarization
+                message = USER_MESSAGE_TEMPLATE.format(
+                    FEEDBACK=format_feedback(post),
+                    MESSAGE="This is the feedback.",
+                )
                 messages.append(HumanMessage(content=message))
-            elif post.send_from == "CodeGenerator" and post.send_to in [
-                "CodeVerifier",
-                "Planner",
-                "Reviser",
-            ]:
-                assert post.original_messages is not None, "Original messages are required."
-                original_messages = [
-                    lc_load(msg)
-                    for msg in post.original_messages
-                ]
-                messages += original_messages
-
-                if is_final_post:
-                    # This human message is added only for examples and context summarization
-                    message = get_prompt_template("code_generator_user_message").format(
-                        FEEDBACK=format_feedback(post),
-                        MESSAGE="This is the feedback.",
-                    )
-                    messages.append(HumanMessage(content=message))
-            elif post.send_from == "CodeVerifier" and post.send_to == "CodeExecutor":
-                # Ignore this post.
-                pass
-            elif post.send_from == "CodeExecutor" and post.send_to == "Planner":
-                # Ignore this post.
-                pass
-            else:
-                raise ValueError(f"Invalid post ({post.send_from} -> {post.send_to}): {post}")
+        elif post.send_from == "CodeVerifier" and post.send_to == "CodeExecutor":
+            # Ignore this post.
+            pass
+        elif post.send_from == "CodeExecutor" and post.send_to == "Planner":
+            # Ignore this post.
+            pass
+        else:
+            raise ValueError(f"Invalid post ({post.send_from} -> {post.send_to}): {post}")
 
-            last_post = post
+        if parts is not None:
+            message = HumanMessage(content="".join(parts))
+            post.set_formatted_message(message_key, message)
+            messages.append(message)
+
+        last_post = post
 
     return messages
 
 
+@lru_cache
+def get_system_message() -> SystemMessage:
+    # Keep the system message byte-identical across calls so that the prompt prefix can be
+    # cached by the LLM provider. Time-varying context goes to the trailing requirements.
+    return SystemMessage(
+        content=SYSTEM_MESSAGE_TEMPLATE.format(
+            ROLE_NAME=ROLE_NAME,
+            RESPONSE_SCHEMA=CODE_GENERATION_RESULT_SCHEMA,
+        )
+    )
+
+
+def format_requirements(agent_config: AgentConfig) -> HumanMessage:
+    return HumanMessage(
+        content=REQUIREMENTS_TEMPLATE.format(
+            ROLE_NAME=ROLE_NAME,
+            CODE_GENERATION_REQUIREMENTS=agent_config.get_requirements_text(ROLE_NAME),
+            ENVIRONMENT_CONTEXT=get_env_context(),
+        )
+    )
+
+
 def format_messages(
     rounds: list[Round],
     agent_config: AgentConfig,
     plugins: list[PluginEntry] | None = None,
     examples: list[Example] | None = None,
+    summary: str | None = None,
 ) -> list[BaseMessage]:
-    messages = []
-
-    system_message = get_prompt_template("code_generator_system_message").format(
-        ENVIRONMENT_CONTEXT=get_env_context(),
-        ROLE_NAME=ROLE_NAME,
-    )
+    # The messages are ordered from the most stable to the least stable:
+    # system message, examples, conversation history, and finally the requirements,
+    # so that the history of previous calls stays a prefix of the next call.
 
     # TODO: add experiences to the system message
-
-    messages.append(SystemMessage(content=system_message))
+    messages: list[BaseMessage] = [get_system_message()]
 
     if examples is not None:
         for example in examples:
-            messages += format_conversation(
-                example.rounds, agent_config, plugins=example.plugins, add_requirements=False
-            )
+            messages += format_conversation(example.rounds, agent_config, plugins=example.plugins)
 
-    # TODO: compress history rounds if needed
-    summary = None
+    messages += format_conversation(rounds, agent_config, plugins=plugins, summary=summary)
 
-    messages += format_conversation(
-        rounds, agent_config, plugins=plugins, add_requirements=True, summary=summary
-    )
+    messages.append(format_requirements(agent_config))
+
+    return messages
+
+
+def compress_history(messages: list[BaseMessage], keep_last: int = 4) -> list[BaseMessage]:
+    """Replaces the code of all but the last `keep_last` replies with one-line summaries.
+
+    It works on a copy of the messages, the original messages of the posts are not modified.
+    """
+
+    ai_indices = [i for i, msg in enumerate(messages) if isinstance(msg, AIMessage)]
+    if len(ai_indices) <= keep_last:
+        return messages
+
+    messages = list(messages)
+    for i in ai_indices[: len(ai_indices) - keep_last]:
+        cg_result, parsing_error = parse_code_generation_result(messages[i])
+        if parsing_error is not None:
+            continue
+
+        lines = cg_result.reply_content.strip().splitlines() or [""]
+        summary = f"[compressed] {len(cg_result.reply_content)} chars | {lines[0]}"
+        if len(lines) > 1:
+            summary += f" -> {lines[-1]}"
+        # Keep the reply in the JSON format, so that the LLM still follows it
+        messages[i] = AIMessage(
+            content=CodeGenerationResult(
+                thought=cg_result.thought,
+                reply_type=cg_result.reply_type,
+                reply_content=summary,
+            ).model_dump_json()
+        )
 
     return messages
 
 
+async def summarize_rounds(
+    agent_config: AgentConfig,
+    rounds: list[Round],
+    summary: str | None = None,
+) -> str:
+    """Folds the rounds into the previous summary with the history summary LLM."""
+
+    rounds_text = "\n\n".join(
+        f"Round {rnd_idx + 1}:\n"
+        + "\n".join(f"{post.send_from} -> {post.send_to}: {post.message}" for post in round.posts)
+        for rnd_idx, round in enumerate(rounds)
+    )
+    prompt = HISTORY_SUMMARY_TEMPLATE.format(
+        ROLE_NAME=ROLE_NAME,
+        SUMMARY=summary if summary is not None else "None",
+        ROUNDS=rounds_text,
+    )
+
+    llm = get_history_summary_llm(agent_config)
+    result = await llm.ainvoke([HumanMessage(content=prompt)])
+    return get_message_text(result).strip()
+
+
+async def apply_history_window(
+    state: CodeInterpreterState,
+    rounds: list[Round],
+    agent_config: AgentConfig,
+) -> tuple[list[Round], str | None, str | None]:
+    """Keeps the last `history_window` rounds and summarizes the older ones.
+
+    The summary is stored in the state with the id of the last summarized round,
+    so that only the rounds that newly rolled off the window are summarized.
+    Returns the rounds in the window, the summary and the id of the last summarized round.
+    """
+
+    window = agent_config.history_window
+    summary = state.history_summary
+    summary_round_id = state.history_summary_round_id
+
+    if window is None or len(rounds) <= window:
+        return rounds, summary, summary_round_id
+
+    old_rounds = rounds[:-window]
+    old_round_ids = [r.id for r in old_rounds]
+    if summary_round_id in old_round_ids:
+        new_rounds = old_rounds[old_round_ids.index(summary_round_id) + 1 :]
+    else:
+        # The summary does not cover these rounds, start over
+        new_rounds = old_rounds
+        summary = None
+
+    if len(new_rounds) > 0:
+        summary = await summarize_rounds(agent_config, new_rounds, summary=summary)
+        summary_round_id = old_round_ids[-1]
+
+    return rounds[-window:], summary, summary_round_id
+
+
+async def invoke_code_generator_llm(
+    agent_config: AgentConfig,
+    messages: list[BaseMessage],
+    event_emitter: EventEmitter,
+) -> AIMessage:
+    llm = get_code_generator_llm(agent_config)
+
+    # The replies are cached here rather than by the model, whose cache `astream` bypasses
+    llm_cache = get_code_generator_llm_cache(agent_config)
+    if llm_cache is not None:
+        cache, llm_string = llm_cache
+        prompt = lc_dumps(messages)
+        cached = await cache.alookup(prompt, llm_string)
+        if cached:
+            message = cached[0].message
+            chunk_text = get_message_text(message)
+            if chunk_text:
+                await event_emitter.emit("cg_chunk", chunk_text)
+            return message
+
+    # Stream the tokens to the listeners as they arrive
+    raw_chunk: AIMessageChunk | None = None
+    async for chunk in llm.astream(messages):
+        raw_chunk = chunk if raw_chunk is None else raw_chunk + chunk
+        chunk_text = get_message_text(chunk)
+        if chunk_text:
+            await event_emitter.emit("cg_chunk", chunk_text)
+    assert raw_chunk is not None, "No output from the code generator LLM."
+    message = message_chunk_to_message(raw_chunk)
+
+    if llm_cache is not None:
+        await cache.aupdate(prompt, llm_string, [ChatGeneration(message=message)])
+    return message
+
+
+def check_code_generation_result(raw_message: AIMessage) -> tuple[CodeGenerationResult, str | None]:
+    """Parses the reply of the LLM, returns the result and the revise message if it is invalid."""
+
+    cg_result, parsing_error = parse_code_generation_result(raw_message)
+
+    revise_message = None
+
+    if parsing_error is not None:
+        revise_message = f"Parsing error:\n{parsing_error}\n\nPlease try again."
+
+    return cg_result, revise_message
+
+
 async def code_generator_node(state: CodeInterpreterState, config: RunnableConfig):
     rounds = state.get_rounds()
     assert len(rounds) > 0, "No round found for CodeGenerator."
@@ -396,40 +636,44 @@ async def code_generator_node(state: CodeInterpreterState, config: RunnableConfi
         f"Agent config is not an instance of AgentConfig: {type(agent_config)}"
     )
 
-    messages = format_messages(rounds, agent_config, plugins=state.plugins)
-
-    llm = get_code_generator_llm(agent_config)
-    result: dict[Literal["raw", "parsed", "parsing_error"], Any] = await llm.ainvoke(messages)
+    window_rounds, history_summary, history_summary_round_id = await apply_history_window(
+        state, rounds, agent_config
+    )
 
-    raw_message: AIMessage = result["raw"]
-    cg_result: CodeGenerationResult = result["parsed"]
-    parsing_error: BaseException | None = result["parsing_error"]
+    messages = format_messages(
+        window_rounds, agent_config, plugins=state.plugins, summary=history_summary
+    )
+    if agent_config.compress_history:
+        messages = compress_history(messages, keep_last=agent_config.compress_history_keep_last)
 
     event_emitter = EventEmitter.get_instance(agent_config.event_handle)
-    await event_emitter.emit("cg_result", cg_result.model_dump(mode="json"))
 
-    revise_message = None
+    raw_message = await invoke_code_generator_llm(agent_config, messages, event_emitter)
+    cg_result, revise_message = check_code_generation_result(raw_message)
 
-    if parsing_error is not None:
-        revise_message = f"Parsing error:\n{parsing_error}\n\nPlease try again."
+    self_correction_count = state.self_correction_count
 
-    if cg_result.reply_type not in ["python", "text"]:
-        revise_message = (
-            f"Unsupported reply_type: `{cg_result.reply_type}`. Please check the `reply_type` field. "
-            "Only `python` and `text` are supported. Please try again."
-        )
+    # Retry malformed replies in place, which saves a round trip through the graph.
+    # The inline retries count towards the self-correction budget.
+    for _ in range(MAX_INLINE_RETRIES):
+        if revise_message is None:
+            break
+        if self_correction_count is not None and self_correction_count >= MAX_SELF_CORRECTIONS:
+            break
+        self_correction_count = self_correction_count + 1 if self_correction_count is not None else 1
 
-    assert len(raw_message.tool_calls) == 1, f"Invalid tool call count: {len(raw_message.tool_calls)}"
-    posts = [
-        cg_result.to_post(
-            original_messages=[
-                raw_message,
-                ToolMessage(content="", tool_call_id=raw_message.tool_calls[0]["id"]),
-            ]
+        await event_emitter.emit("cg_revise_message", revise_message)
+
+        raw_message = await invoke_code_generator_llm(
+            agent_config,
+            messages + [raw_message, HumanMessage(content=revise_message)],
+            event_emitter,
         )
-    ]
+        cg_result, revise_message = check_code_generation_result(raw_message)
 
-    self_correction_count = state.self_correction_count
+    await event_emitter.emit("cg_result", cg_result.model_dump(mode="json"))
+
+    posts = [cg_result.to_post(original_messages=[raw_message])]
 
     if revise_message is not None:
         # Self-correction. Max 3 times.
@@ -451,6 +695,8 @@ async def code_generator_node(state: CodeInterpreterState, config: RunnableConfi
             posts=posts,
         ),
         "self_correction_count": self_correction_count,
+        "history_summary": history_summary,
+        "history_summary_round_id": history_summary_round_id,
     }
 
 
@@ -475,8 +721,8 @@ def code_generator_router_edge(state: CodeInterpreterState) -> str:
             f"Reviser must send to CodeGenerator, but got `{last_post.send_to}`."
         )
 
-        self_correction_count = state.code_generator_self_correction_count
-        if self_correction_count is None or self_correction_count <= 3:
+        self_correction_count = state.self_correction_count
+        if self_correction_count is None or self_correction_count <= MAX_SELF_CORRECTIONS:
             return "code_generator_node"
         else:
             return END
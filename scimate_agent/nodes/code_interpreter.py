@@ -27,31 +27,20 @@ async def code_interpreter_node(state: AgentState, config: RunnableConfig) -> di
     assert current_post.send_from == "Planner", "CodeInterpreter must receive a post from Planner."
     assert current_post.send_to == "CodeInterpreter", "Invalid post, send_to must be CodeInterpreter."
 
-    new_post = current_post.model_copy()
-    new_post.send_to = "CodeGenerator"
-
     plan_list = current_post.get_attachments(AttachmentType.PLAN)
     assert len(plan_list) == 1, "Invalid post, plan must be a single attachment."
     plan = plan_list[0]
-    new_post.attachments = new_post.attachments + [
-        Attachment.new(
-            type=AttachmentType.PLAN_ENRICHMENT,
-            content=f"\n====== Plan ======\nI have drawn up a plan:\n{plan.content}\n==================\n",
-        )
-    ]
-
-    ci_state = CodeInterpreterState(
-        rounds=[
-            Round.new(
-                user_query=current_round.user_query,
-                posts=[new_post],
-            )
-        ],
-        plugins=state.plugins,
-        self_correction_count=None,
-        env_id=state.env_id,
-        env_dir=state.env_dir,
-        session_id=state.session_id,
+
+    new_post = current_post.model_copy(
+        update={
+            "send_to": "CodeGenerator",
+            "attachments": current_post.attachments + [
+                Attachment.new(
+                    type=AttachmentType.PLAN_ENRICHMENT,
+                    content=f"\n====== Plan ======\nI have drawn up a plan:\n{plan.content}\n==================\n",
+                )
+            ],
+        }
     )
 
     from scimate_agent.agent import code_interpreter_graph
@@ -69,11 +58,32 @@ async def code_interpreter_node(state: AgentState, config: RunnableConfig) -> di
         }
     }
 
+    # The summary of the history is kept across the invocations of the subgraph
+    previous_values = (await code_interpreter_graph.aget_state(subgraph_config)).values
+
+    # All the fields are validated already, skip the validation of the sub-state
+    ci_state = CodeInterpreterState.model_construct(
+        rounds=[
+            Round.new(
+                user_query=current_round.user_query,
+                posts=[new_post],
+            )
+        ],
+        plugins=state.plugins,
+        self_correction_count=None,
+        env_id=state.env_id,
+        env_dir=state.env_dir,
+        session_id=state.session_id,
+        history_summary=previous_values.get("history_summary"),
+        history_summary_round_id=previous_values.get("history_summary_round_id"),
+    )
+
     result = await code_interpreter_graph.ainvoke(
         ci_state,
         config=subgraph_config,
     )
-    final_state = CodeInterpreterState(**result)
+    # The subgraph returns the channel values of its own validated state
+    final_state = CodeInterpreterState.model_construct(**result)
 
     ci_rounds = final_state.rounds
     assert len(ci_rounds) > 0, "No round found for CodeInterpreter."
@@ -87,8 +97,7 @@ async def code_interpreter_node(state: AgentState, config: RunnableConfig) -> di
         f"{current_post}"
     )
 
-    new_post = ci_current_post.model_copy()
-    new_post.send_from = "CodeInterpreter"
+    new_post = ci_current_post.model_copy(update={"send_from": "CodeInterpreter"})
 
     return {
         "rounds": RoundUpdate(
@@ -1,7 +1,10 @@
 import ast
 import asyncio
-import re
-from typing import Any
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Any, Callable
 
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import END
@@ -10,36 +13,64 @@ from scimate_agent.config import AgentConfig
 from scimate_agent.event import EventEmitter
 from scimate_agent.state import Attachment, AttachmentType, CodeInterpreterState, Post, RoundUpdate
 
-LINE_MAGIC_PATTERN = re.compile(r"^\s*%\s*[a-zA-Z_]\w*")
-CELL_MAGIC_PATTERN = re.compile(r"^\s*%%\s*[a-zA-Z_]\w*")
-SHELL_COMMAND_PATTERN = re.compile(r"^\s*!")
 
+def seperate_code_lines(code: str) -> tuple[list[str], str, list[str], list[str]]:
+    """Returns the magics, the python code, the shell commands and the stripped python lines."""
 
-def seperate_code_lines(code: str) -> tuple[list[str], str, list[str]]:
     magics = []
     python_lines = []
+    python_lines_stripped = []
     shell_lines = []
 
+    # Bind the methods to locals, this loop runs for every line of the code
+    append_magic = magics.append
+    append_python = python_lines.append
+    append_python_stripped = python_lines_stripped.append
+    append_shell = shell_lines.append
+
     inside_cell_magic = False
     for line in code.splitlines():
-        if not line.strip() or line.strip().startswith("#"):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
             continue
 
         if inside_cell_magic:
-            magics.append(line)
-            if not line.strip():
-                inside_cell_magic = False
-        elif LINE_MAGIC_PATTERN.match(line):
-            magics.append(line)
-        elif CELL_MAGIC_PATTERN.match(line):
-            magics.append(line)
-            inside_cell_magic = True
-        elif SHELL_COMMAND_PATTERN.match(line):
-            shell_lines.append(line)
+            append_magic(line)
+            continue
+
+        # Python code never starts with `%` or `!`, so the first character tells the kind
+        # of the line: `%` starts a magic (`%%` a cell magic) and `!` a shell command
+        first_char = stripped[0]
+        if first_char == "%":
+            append_magic(line)
+            if stripped.startswith("%%"):
+                inside_cell_magic = True
+        elif first_char == "!":
+            append_shell(line)
         else:
-            python_lines.append(line)
+            append_python(line)
+            append_python_stripped(stripped)
+
+    return magics, "\n".join(python_lines), shell_lines, python_lines_stripped
+
 
-    return magics, "\n".join(python_lines), shell_lines
+def _to_frozenset(names: list[str] | None) -> frozenset[str] | None:
+    return frozenset(names) if names is not None else None
+
+
+def _collect_target_names(target: ast.expr, names: list[str]):
+    """Collects the names of the variables assigned by an assignment target."""
+
+    if isinstance(target, ast.Name):
+        names.append(target.id)
+    elif isinstance(target, (ast.Tuple, ast.List)):
+        for elt in target.elts:
+            _collect_target_names(elt, names)
+    elif isinstance(target, ast.Starred):
+        _collect_target_names(target.value, names)
+    elif isinstance(target, (ast.Attribute, ast.Subscript)):
+        # `a.b = ...` and `a[i] = ...` modify `a`, the names in the index are only read
+        _collect_target_names(target.value, names)
 
 
 class FunctionCallValidator(ast.NodeVisitor):
@@ -56,24 +87,67 @@ class FunctionCallValidator(ast.NodeVisitor):
         self.lines = lines
         self.errors = []
 
-        self.allowed_modules = allowed_modules
-        self.blocked_modules = blocked_modules
+        self.allowed_modules = _to_frozenset(allowed_modules)
+        self.blocked_modules = _to_frozenset(blocked_modules)
         assert (
             allowed_modules is None or blocked_modules is None
         ), "Only one of allowed_modules or blocked_modules can be set."
 
-        self.blocked_functions = blocked_functions
-        self.allowed_functions = allowed_functions
+        self.blocked_functions = _to_frozenset(blocked_functions)
+        self.allowed_functions = _to_frozenset(allowed_functions)
         assert (
             allowed_functions is None or blocked_functions is None
         ), "Only one of allowed_functions or blocked_functions can be set."
 
-        self.allowed_variables = allowed_variables
-        self.blocked_variables = blocked_variables
+        self.allowed_variables = _to_frozenset(allowed_variables)
+        self.blocked_variables = _to_frozenset(blocked_variables)
         assert (
             allowed_variables is None or blocked_variables is None
         ), "Only one of allowed_variables or blocked_variables can be set."
 
+        self.has_any_filter = any(
+            f is not None
+            for f in (
+                allowed_modules,
+                blocked_modules,
+                allowed_functions,
+                blocked_functions,
+                allowed_variables,
+                blocked_variables,
+            )
+        )
+
+        # Rule to call on the nodes of each type during `validate`, all in a single walk
+        self._rules: dict[type[ast.AST], Callable[[Any], None]] = {
+            ast.Call: self.visit_Call,
+            ast.Import: self.visit_Import,
+            ast.ImportFrom: self.visit_ImportFrom,
+            ast.Assign: self.visit_Assign,
+        }
+        # Imports and assignments cannot appear inside expressions,
+        # so the expressions are only walked when the function calls are checked.
+        self._walk_expr = self.allowed_functions is not None or self.blocked_functions is not None
+
+    def validate(self, tree: ast.AST):
+        """Same as `visit`, but walks the tree iteratively."""
+
+        if not self.has_any_filter:
+            # Nothing to check
+            return
+
+        rules = self._rules
+        walk_expr = self._walk_expr
+        stack = [tree]
+        while stack:
+            node = stack.pop()
+            rule = rules.get(type(node))
+            if rule is not None:
+                # As with `visit`, the children of the handled nodes are not visited
+                rule(node)
+            elif walk_expr or not isinstance(node, ast.expr):
+                # Reversed, so that the nodes are visited in the same order as `visit`
+                stack.extend(reversed(list(ast.iter_child_nodes(node))))
+
     def _is_allowed_function_call(self, func_name: str) -> bool:
         if self.allowed_functions is not None and func_name in self.allowed_functions:
             return True
@@ -110,10 +184,7 @@ class FunctionCallValidator(ast.NodeVisitor):
             return
 
         for alias in node.names:
-            if "." in alias.name:
-                module_name = alias.name.split(".")[0]
-            else:
-                module_name = alias.name
+            module_name = alias.name.partition(".")[0]
 
             if not self._is_allowed_module_import(module_name):
                 self.errors.append(
@@ -125,10 +196,11 @@ class FunctionCallValidator(ast.NodeVisitor):
         if self.allowed_modules is None and self.blocked_modules is None:
             return
 
-        if "." in node.module:
-            module_name = node.module.split(".")[0]
-        else:
-            module_name = node.module
+        if node.module is None:
+            # `from . import x`, a relative import of the local package
+            return
+
+        module_name = node.module.partition(".")[0]
 
         if not self._is_allowed_module_import(module_name):
             self.errors.append(
@@ -149,12 +221,7 @@ class FunctionCallValidator(ast.NodeVisitor):
 
         for target in node.targets:
             variable_names = []
-            if isinstance(target, ast.Name):
-                variable_names.append(target.id)
-            else:
-                for name in ast.walk(target):
-                    if isinstance(name, ast.Name):
-                        variable_names.append(name.id)
+            _collect_target_names(target, variable_names)
 
             for var_name in variable_names:
                 if not self._is_allowed_variable_assignment(var_name):
@@ -164,6 +231,23 @@ class FunctionCallValidator(ast.NodeVisitor):
                     )
 
 
+@lru_cache(maxsize=256)
+def parse_code(python_code: str) -> ast.Module:
+    """Parses the code, the same code is often verified again across self-corrections.
+
+    CAUTION: The tree is shared between the callers, it must not be mutated.
+    """
+    # Same parser as `ast.parse` without its Python-level wrapper. Top-level `await` is
+    # allowed, since the code is run by an IPython kernel.
+    return compile(
+        python_code,
+        "<verifier>",
+        "exec",
+        flags=ast.PyCF_ONLY_AST | ast.PyCF_ALLOW_TOP_LEVEL_AWAIT,
+        dont_inherit=True,
+    )
+
+
 def apply_code_verification(
     code: str,
     allowed_modules: list[str] | None = None,
@@ -177,18 +261,15 @@ def apply_code_verification(
     errors = []
 
     try:
-        magics, python_code, _ = seperate_code_lines(code)
+        magics, python_code, _, python_lines = seperate_code_lines(code)
         if len(magics) > 0:
             errors.append("Magic commands are not allowed.")
 
-        tree = ast.parse(python_code)
+        tree = parse_code(python_code)
 
+        # Without any filters, only the syntax is checked and `validate` returns right away
         validator = FunctionCallValidator(
-            lines=[
-                line.strip()
-                for line in python_code.splitlines()
-                if line.strip() and not line.strip().startswith("#")
-            ],
+            lines=python_lines,
             allowed_modules=allowed_modules,
             blocked_modules=blocked_modules,
             allowed_functions=allowed_functions,
@@ -196,7 +277,7 @@ def apply_code_verification(
             allowed_variables=allowed_variables,
             blocked_variables=blocked_variables,
         )
-        validator.visit(tree)
+        validator.validate(tree)
         errors.extend(validator.errors)
     except Exception as e:
         errors.append(f"Syntax error: {e}")
@@ -204,6 +285,34 @@ def apply_code_verification(
     return errors
 
 
+_verification_pool: ProcessPoolExecutor | None = None
+
+
+def get_verification_pool(max_workers: int) -> ProcessPoolExecutor:
+    """Returns the process pool shared by the verifications, so that they do not contend
+    for the GIL with the event loop. Each worker keeps its own AST cache."""
+
+    global _verification_pool
+
+    if _verification_pool is None:
+        _verification_pool = ProcessPoolExecutor(
+            max_workers=max(1, min(max_workers, os.cpu_count() or 1)),
+            # Do not fork the server process, with its event loop, threads and kernel managers
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return _verification_pool
+
+
+def shutdown_verification_pool() -> None:
+    """Stops the workers of the verification pool, if it was started."""
+
+    global _verification_pool
+
+    if _verification_pool is not None:
+        _verification_pool.shutdown(wait=True, cancel_futures=True)
+        _verification_pool = None
+
+
 async def code_verifier_node(state: CodeInterpreterState, config: RunnableConfig) -> dict[str, Any]:
     rounds = state.get_rounds()
     assert len(rounds) > 0, "No round found for CodeVerifier."
@@ -219,18 +328,24 @@ async def code_verifier_node(state: CodeInterpreterState, config: RunnableConfig
 
     code = last_post.message
 
-    errors = await asyncio.to_thread(apply_code_verification, code)
-
     agent_config: AgentConfig = config["configurable"]["agent_config"]
     assert isinstance(agent_config, AgentConfig), (
         f"Agent config is not an instance of AgentConfig: {type(agent_config)}"
     )
 
+    if agent_config.verify_code_in_process_pool:
+        loop = asyncio.get_running_loop()
+        pool = get_verification_pool(agent_config.verify_code_pool_max_workers)
+        errors = await loop.run_in_executor(pool, apply_code_verification, code)
+    else:
+        errors = await asyncio.to_thread(apply_code_verification, code)
+
     event_emitter = EventEmitter.get_instance(agent_config.event_handle)
     await event_emitter.emit("cv_result", errors)
 
     self_correction_count = state.self_correction_count
 
+    # The posts are built from validated values, so their validation is skipped
     if len(errors) > 0:
         error_message = "\n".join(errors)
         post = Post.new(
@@ -242,9 +357,11 @@ async def code_verifier_node(state: CodeInterpreterState, config: RunnableConfig
                     type=AttachmentType.CODE_VERIFICATION_RESULT,
                     content=error_message,
                     extra=errors,
+                    validate=False,
                 )
             ],
             original_messages=last_post.original_messages,
+            validate=False,
         )
         self_correction_count = self_correction_count + 1 if self_correction_count is not None else 1
     else:
@@ -258,8 +375,10 @@ async def code_verifier_node(state: CodeInterpreterState, config: RunnableConfig
                 Attachment.new(
                     type=AttachmentType.CODE_VERIFICATION_RESULT,
                     content="Code verification has been passed.",
+                    validate=False,
                 )
             ],
+            validate=False,
         )
 
     return {
@@ -271,10 +390,9 @@ async def code_verifier_node(state: CodeInterpreterState, config: RunnableConfig
     }
 
 def code_verifier_router_edge(state: CodeInterpreterState) -> str:
-    rounds = state.get_rounds()
-    assert len(rounds) > 0, "No round found for CodeVerifier."
+    last_round = state.get_last_round()
+    assert last_round is not None, "No round found for CodeVerifier."
 
-    last_round = rounds[-1]
     if len(last_round.posts) == 0:
         raise ValueError("No post found for CodeVerifier.")
     last_post = last_round.posts[-1]
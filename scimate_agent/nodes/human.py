@@ -5,7 +5,7 @@ from scimate_agent.interrupt import ExitCommand, Interruption
 from scimate_agent.state import AgentState, Post, Round
 
 
-def human_node(state: AgentState):
+async def human_node(state: AgentState):
     current_round = state.get_rounds("User")[-1]
     assert len(current_round.posts) > 0, "No post found for User."
 
@@ -1,7 +1,6 @@
 from functools import lru_cache
 from typing import Any, Literal
 
-from langchain_core.load import load as lc_load
 from langchain_core.messages import (
     AIMessage,
     BaseMessage,
@@ -67,22 +66,27 @@ class Plan(BaseModel):
         id: str | None = None,
         original_messages: list[BaseMessage] | None = None,
     ) -> Post:
+        # The plan is validated already, so is the post built from it
         attachments = [
             Attachment.new(
                 type=AttachmentType.THOUGHT,
                 content=self.thought,
+                validate=False,
             ),
             Attachment.new(
                 type=AttachmentType.INIT_PLAN,
                 content=self.init_plan,
+                validate=False,
             ),
             Attachment.new(
                 type=AttachmentType.PLAN,
                 content=self.plan,
+                validate=False,
             ),
             Attachment.new(
                 type=AttachmentType.CURRENT_PLAN_STEP,
                 content=self.current_plan_step,
+                validate=False,
             ),
         ]
 
@@ -93,6 +97,7 @@ class Plan(BaseModel):
             message=self.message,
             attachments=attachments,
             original_messages=original_messages,
+            validate=False,
         )
 
 
@@ -120,6 +125,17 @@ def get_planner_llm(agent_config: AgentConfig):
     )
 
 
+@lru_cache(maxsize=32)
+def get_system_message(plugins_desc: str) -> SystemMessage:
+    # The environment context changes over time, so it is appended after the history
+    # to keep the system message stable across calls.
+    return SystemMessage(
+        content=get_prompt_template("planner_system_message").format(
+            PLUGINS_DESCRIPTION=plugins_desc,
+        )
+    )
+
+
 def format_messages(rounds: list[Round], plugins: list[PluginEntry]) -> list[BaseMessage]:
     messages = []
 
@@ -128,14 +144,9 @@ def format_messages(rounds: list[Round], plugins: list[PluginEntry]) -> list[Bas
     else:
         plugins_desc = "None"
 
-    system_message = get_prompt_template("planner_system_message").format(
-        ENVIRONMENT_CONTEXT=get_env_context(),
-        PLUGINS_DESCRIPTION=plugins_desc,
-    )
-
     # TODO: add experiences to the system message
 
-    messages.append(SystemMessage(content=system_message))
+    messages.append(get_system_message(plugins_desc))
 
     # TODO: add examples
 
@@ -150,11 +161,7 @@ def format_messages(rounds: list[Round], plugins: list[PluginEntry]) -> list[Bas
 
             if post.send_from == "Planner":
                 assert post.original_messages is not None, "Original messages are required for Planner."
-                original_messages = [
-                    lc_load(msg)
-                    for msg in post.original_messages
-                ]
-                messages += original_messages
+                messages += post.get_original_messages()
             else:
                 if rnd_idx == 0 and post_idx == 0:
                     message = f"{conv_prefix}\n{post.message}"
@@ -163,6 +170,10 @@ def format_messages(rounds: list[Round], plugins: list[PluginEntry]) -> list[Bas
                 message = f"From: {post.send_from}\nMessage: {message}"
                 messages.append(HumanMessage(content=message))
 
+    messages.append(
+        HumanMessage(content=f"## About the current environment context\n{get_env_context()}")
+    )
+
     return messages
 
 
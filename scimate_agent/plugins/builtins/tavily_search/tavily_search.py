@@ -1,3 +1,5 @@
+import asyncio
+from functools import lru_cache
 from typing import Any, Literal
 
 from scimate_agent.plugins import Plugin, register_plugin
@@ -10,6 +12,12 @@ except ImportError:
     )
 
 
+@lru_cache(maxsize=8)
+def get_tavily_client(api_key: str | None) -> TavilyClient:
+    # Shared by the plugin instances, which may be recreated for every execution
+    return TavilyClient(api_key=api_key)
+
+
 @register_plugin
 class TavilySearch(Plugin):
     client: TavilyClient | None = None
@@ -23,7 +31,7 @@ class TavilySearch(Plugin):
         max_results: int = 5,
     ) -> list[dict[str, Any]]:
         if self.client is None:
-            self.client = TavilyClient(api_key=self.config.get("tavily_api_key", None))
+            self.client = get_tavily_client(self.config.get("tavily_api_key", None))
 
         resp = self.client.search(
             query=query,
@@ -46,3 +54,9 @@ class TavilySearch(Plugin):
                 result["url"] = original_result["url"]
 
         return results
+
+    async def acall(self, queries: list[str], **kwargs: Any) -> list[list[dict[str, Any]]]:
+        """Searches the queries concurrently, returns the results of each query in order."""
+        return await asyncio.gather(
+            *(asyncio.to_thread(self, query, **kwargs) for query in queries)
+        )
@@ -5,6 +5,10 @@ from typing import Literal
 PromptName = Literal[
     "planner_system_message",
     "code_generator_system_message",
+    "code_generator_conv_head",
+    "code_generator_user_message",
+    "code_generator_requirements",
+    "code_generator_history_summary",
 ]
 
 
@@ -1,11 +1,12 @@
-import uuid
 from enum import Enum
 from typing import Any
 
 from pydantic import BaseModel
 
+from scimate_agent.utils.ids import new_id
 
-class AttachmentType(Enum):
+
+class AttachmentType(str, Enum):
     # Planner
     THOUGHT = "thought"
     INIT_PLAN = "init_plan"
@@ -32,10 +33,13 @@ class Attachment(BaseModel):
         content: str,
         extra: Any | None = None,
         id: str | None = None,
+        validate: bool = True,
     ) -> "Attachment":
+        """Creates an attachment. Set `validate` to False to skip the validation of trusted values."""
         if id is None:
-            id = str(uuid.uuid4())
-        return cls(
+            id = new_id()
+        factory = cls if validate else cls.model_construct
+        return factory(
             id=id,
             type=type,
             content=content,
@@ -1,25 +1,50 @@
 import hashlib
 import io
-import json
+import os
 import tarfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Optional, TYPE_CHECKING
+from typing import IO, Any, Callable, Optional, TYPE_CHECKING
 
 import structlog
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, PrivateAttr
 
-from scimate_agent.utils import read_yaml, write_yaml
+from scimate_agent.utils import fast_json, read_yaml, write_yaml
 
 if TYPE_CHECKING:
     from structlog.stdlib import AsyncBoundLogger
 
 logger: "AsyncBoundLogger" = structlog.get_logger()
 
+# Bump whenever the bytes fed into the plugin hashsum change, to invalidate the stored hashsums
+_HASH_VERSION = 3
+
+
+_TYPE_ALIASES: dict[str, str] = {
+    "string": "str",
+    "integer": "int",
+    "boolean": "bool",
+}
+
+# Choice type -> (expected Python type, description for errors, formatter)
+_CHOICE_FORMATS: dict[str, tuple[type, str, Callable[[Any], str]]] = {
+    "str": (str, "a string", lambda choice: f'"{choice}"'),
+    "int": (int, "an integer", str),
+    "float": (float, "a float", str),
+    "bool": (bool, "a boolean", str),
+}
+
 
 class PluginMetadata(BaseModel):
     name: str
     path: str
     hashsum: str | None = None
+    # Latest modification time, number and total size of the plugin files when `hashsum` was computed
+    mtime_ns_max: int | None = None
+    file_count: int | None = None
+    total_size: int | None = None
+    # Version of the hashing scheme `hashsum` was computed with
+    hash_version: int | None = None
     embeddings: dict[str, list[float]] | None = None
 
 
@@ -54,47 +79,23 @@ class PluginParameter(BaseModel):
         return self.description.strip().replace("\n", "\n# ")
 
     def normalize_type(self) -> str:
-        typ = self.type
-
-        if typ.lower() == "string":
-            typ = "str"
-        elif typ.lower() == "integer":
-            typ = "int"
-        elif typ.lower() == "boolean":
-            typ = "bool"
+        typ = _TYPE_ALIASES.get(self.type.lower(), self.type)
 
         if self.choices:
+            choice_format = _CHOICE_FORMATS.get(typ)
+            if choice_format is None:
+                raise ValueError(
+                    f"Invalid choice type: {type(self.choices[0])}. "
+                    f"Expected one of: str, int, float, bool."
+                )
+            expected_type, type_desc, fmt = choice_format
             choice_strs = []
             for choice in self.choices:
-                if typ == "str":
-                    assert isinstance(choice, str), (
-                        "Choice must be a string, "
-                        f"but got {type(choice)}."
-                    )
-                    choice_strs.append(f'"{choice}"')
-                elif typ == "int":
-                    assert isinstance(choice, int), (
-                        "Choice must be an integer, "
-                        f"but got {type(choice)}."
-                    )
-                    choice_strs.append(f"{choice}")
-                elif typ == "float":
-                    assert isinstance(choice, float), (
-                        "Choice must be a float, "
-                        f"but got {type(choice)}."
-                    )
-                    choice_strs.append(f"{choice}")
-                elif typ == "bool":
-                    assert isinstance(choice, bool), (
-                        "Choice must be a boolean, "
-                        f"but got {type(choice)}."
-                    )
-                    choice_strs.append(f"{choice}")
-                else:
-                    raise ValueError(
-                        f"Invalid choice type: {type(choice)}. "
-                        f"Expected one of: str, int, float, bool."
-                    )
+                assert isinstance(choice, expected_type), (
+                    f"Choice must be {type_desc}, "
+                    f"but got {type(choice)}."
+                )
+                choice_strs.append(fmt(choice))
             typ = f"Literal[{', '.join(choice_strs)}]"
 
         if not self.required and self.default is None:
@@ -135,20 +136,20 @@ class PluginSpec(BaseModel):
         return desc
 
     def format_prompt(self) -> str:
-        prompt = f"`{self.name}`: {self.description}\n\n"
-        prompt += f"```python\ndef {self.name}(\n"
+        # Collected into parts and joined once, rather than growing a string
+        parts = [f"`{self.name}`: {self.description}\n\n", f"```python\ndef {self.name}(\n"]
 
         for param in self.parameters:
             if param.required:
-                prompt += f"    # {param.normalize_description()}\n"
+                parts.append(f"    # {param.normalize_description()}\n")
             else:
-                prompt += f"    # (Optional) {param.normalize_description()}\n"
+                parts.append(f"    # (Optional) {param.normalize_description()}\n")
 
             if param.required:
                 assert param.default is None, "Required parameter cannot have a default value."
-                prompt += f"    {param.name}: {param.normalize_type()},\n"
+                parts.append(f"    {param.name}: {param.normalize_type()},\n")
             else:
-                prompt += f"    {param.name}: {param.normalize_type()} = {param.normalize_default()},\n"
+                parts.append(f"    {param.name}: {param.normalize_type()} = {param.normalize_default()},\n")
 
         if len(self.returns) == 0:
             return_type = "None"
@@ -157,29 +158,26 @@ class PluginSpec(BaseModel):
         else:
             return_type = f"Tuple[{', '.join(r.normalize_type() for r in self.returns)}]"
 
-        prompt += f"): -> {return_type}:\n"
+        parts.append(f"): -> {return_type}:\n")
         if len(self.returns) > 0:
-            prompt += "    \"\"\"\n"
-            prompt += "    Returns:\n"
+            parts.append("    \"\"\"\n")
+            parts.append("    Returns:\n")
             for i, r in enumerate(self.returns):
                 desc = r.description.strip().replace("\n", "\n            ")
                 prefix = f"{i + 1}. " if len(self.returns) > 1 else ""
-                prompt += f"        {prefix}{r.name}: {desc}\n"
+                parts.append(f"        {prefix}{r.name}: {desc}\n")
 
             if self.examples:
-                prompt += "\n"
-                prompt += "    Examples:\n"
-                example_strs = []
-                for example in self.examples:
-                    example_strs.append(f"        {example}")
-                prompt += "\n\n".join(example_strs)
-                prompt += "\n"
+                parts.append("\n")
+                parts.append("    Examples:\n")
+                parts.append("\n\n".join(f"        {example}" for example in self.examples))
+                parts.append("\n")
 
-            prompt += "    \"\"\"\n"
+            parts.append("    \"\"\"\n")
 
-        prompt += "    ...\n```"
+        parts.append("    ...\n```")
 
-        return prompt
+        return "".join(parts)
 
 
 class PluginEntry(BaseModel):
@@ -187,6 +185,11 @@ class PluginEntry(BaseModel):
     spec: PluginSpec
     metadata: PluginMetadata
 
+    # Rendered prompt of the spec, rendered on first use
+    _prompt: str | None = PrivateAttr(default=None)
+    # Rendered descriptions of the spec by indent, rendered on first use
+    _descriptions: dict[int, str] = PrivateAttr(default_factory=dict)
+
     @property
     def enabled(self) -> bool:
         return self.spec.enabled
@@ -245,11 +248,24 @@ class PluginEntry(BaseModel):
             metadata=metadata,
         )
 
-        if plugin.metadata.hashsum is None:
-            plugin_package_bytes = plugin.load_plugin_package()
-            config_bytes = json.dumps(spec.configurations, sort_keys=True).encode("utf-8")
-            hashsum = hashlib.sha256(plugin_package_bytes + config_bytes).hexdigest()
+        # Recompute the hashsum only if the plugin files have changed since it was computed.
+        # An edit that keeps the same latest mtime, file count and total size goes unnoticed.
+        fingerprint = _get_files_fingerprint(Path(plugin.metadata.path))
+        if (
+            plugin.metadata.hashsum is None
+            or (plugin.metadata.mtime_ns_max, plugin.metadata.file_count, plugin.metadata.total_size)
+            != fingerprint
+            or plugin.metadata.hash_version != _HASH_VERSION
+        ):
+            # Hash the package as it is written, without keeping it in memory
+            hash_obj = hashlib.sha256(f"v{_HASH_VERSION}:".encode())
+            # The package is only hashed here, so skip the compression
+            plugin.write_plugin_package(_HashingWriter(hash_obj), compress=False)
+            hash_obj.update(fast_json.dumpb(spec.configurations, sort_keys=True))
+            hashsum = hash_obj.hexdigest()
             plugin.metadata.hashsum = hashsum
+            plugin.metadata.mtime_ns_max, plugin.metadata.file_count, plugin.metadata.total_size = fingerprint
+            plugin.metadata.hash_version = _HASH_VERSION
             metadata_write_back = True
 
         if metadata_write_back:
@@ -259,12 +275,18 @@ class PluginEntry(BaseModel):
         return plugin
 
     def format_description(self, indent: int = 0) -> str:
-        return self.spec.format_description(indent)
+        if indent not in self._descriptions:
+            self._descriptions[indent] = self.spec.format_description(indent)
+        return self._descriptions[indent]
 
     def format_prompt(self) -> str:
-        return self.spec.format_prompt()
+        if self._prompt is None:
+            self._prompt = self.spec.format_prompt()
+        return self._prompt
+
+    def write_plugin_package(self, fileobj: IO[bytes], compress: bool = True) -> None:
+        """Packages the plugin into a tar.gz (or a plain tar), written to `fileobj` as it is built."""
 
-    def load_plugin_package(self) -> bytes:
         plugin_path = Path(self.metadata.path)
 
         def filter_fn(tarinfo: tarfile.TarInfo) -> tarfile.TarInfo | None:
@@ -272,15 +294,56 @@ class PluginEntry(BaseModel):
                 return None
             return tarinfo
 
-        # Package the plugin into a tar.gz
+        with tarfile.open(fileobj=fileobj, mode="w|gz" if compress else "w|") as tar:
+            tar.add(plugin_path, arcname="plugin", filter=filter_fn)
+
+    def load_plugin_package(self) -> bytes:
         with io.BytesIO() as tar_buffer:
-            with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar:
-                tar.add(plugin_path, arcname="plugin", filter=filter_fn)
+            self.write_plugin_package(tar_buffer)
             return tar_buffer.getvalue()
 
 
+def _get_files_fingerprint(path: Path) -> tuple[int, int, int]:
+    """Returns the latest modification time, the number and the total size of the files
+    under `path`, except the metadata."""
+
+    mtime_ns_max = 0
+    file_count = 0
+    total_size = 0
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.name == ".metadata.yaml":
+                continue
+            stat = entry.stat(follow_symlinks=False)
+            mtime_ns_max = max(mtime_ns_max, stat.st_mtime_ns)
+            if entry.is_dir(follow_symlinks=False):
+                sub_mtime_ns_max, sub_file_count, sub_total_size = _get_files_fingerprint(Path(entry.path))
+                mtime_ns_max = max(mtime_ns_max, sub_mtime_ns_max)
+                file_count += sub_file_count
+                total_size += sub_total_size
+            else:
+                file_count += 1
+                total_size += stat.st_size
+    return mtime_ns_max, file_count, total_size
+
+
+class _HashingWriter(io.RawIOBase):
+    """A write-only file object that feeds the written bytes into a hash, instead of keeping them."""
+
+    def __init__(self, hash_obj: "hashlib._Hash"):
+        super().__init__()
+        self.hash_obj = hash_obj
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.hash_obj.update(b)
+        return len(b)
+
+
 def load_plugins(search_paths: list[str | Path]) -> list[PluginEntry]:
-    plugins: list[PluginEntry] = []
+    entries: list[Path] = []
     for path in search_paths:
         path = Path(path)
         if not path.exists():
@@ -288,11 +351,23 @@ def load_plugins(search_paths: list[str | Path]) -> list[PluginEntry]:
 
         for entry in path.iterdir():
             if entry.is_dir() and (entry / "spec.yaml").exists():
-                try:
-                    plugin = PluginEntry.from_local_path(entry)
-                    if plugin:
-                        plugins.append(plugin)
-                except Exception as e:
-                    logger.error("Error loading plugin", path=entry, error=e)
+                entries.append(entry)
+
+    if not entries:
+        return []
+
+    # Loading reads and writes YAML and hashes the plugin files, so load the plugins concurrently
+    plugins: list[PluginEntry] = []
+    max_workers = min(32, (os.cpu_count() or 1) * 4, len(entries))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(PluginEntry.from_local_path, entry) for entry in entries]
+        # Collect in submission order to keep the plugin order deterministic
+        for entry, future in zip(entries, futures):
+            try:
+                plugin = future.result()
+                if plugin:
+                    plugins.append(plugin)
+            except Exception as e:
+                logger.error("Error loading plugin", path=entry, error=e)
 
     return plugins
@@ -1,9 +1,41 @@
-import uuid
+from typing import Any
 
-from langchain_core.messages import BaseMessage
-from pydantic import BaseModel
+from langchain_core.load import load as lc_load
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    SystemMessage,
+    ToolMessage,
+)
+from pydantic import BaseModel, PrivateAttr
 
-from .attachment import Attachment
+from scimate_agent.utils.ids import new_id
+
+from .attachment import Attachment, AttachmentType
+
+MESSAGE_TYPES: dict[str, type[BaseMessage]] = {
+    "ai": AIMessage,
+    "human": HumanMessage,
+    "system": SystemMessage,
+    "tool": ToolMessage,
+}
+
+
+def dump_message(msg: BaseMessage | dict) -> dict:
+    if isinstance(msg, dict):
+        return msg
+    if MESSAGE_TYPES.get(msg.type) is type(msg):
+        # Serialize with pydantic-core, tagged with the message type for `load_message`
+        return {"type": msg.type, "json": msg.model_dump_json()}
+    return msg.to_json()
+
+
+def load_message(data: dict) -> BaseMessage:
+    if "lc" in data:
+        # Serialized by LangChain
+        return lc_load(data)
+    return MESSAGE_TYPES[data["type"]].model_validate_json(data["json"])
 
 
 class Post(BaseModel):
@@ -15,6 +47,15 @@ class Post(BaseModel):
 
     original_messages: list[dict] | None
 
+    # Deserialized `original_messages`, loaded on first use
+    _loaded_original_messages: list[BaseMessage] | None = PrivateAttr(default=None)
+    # `attachments` grouped by type, with the list it was built from
+    _attachments_by_type: tuple[list[Attachment], dict[AttachmentType, list[Attachment]]] | None = (
+        PrivateAttr(default=None)
+    )
+    # Message formatted from this post by the prompt formatters, with the key it was formatted for
+    _formatted_message: tuple[Any, BaseMessage] | None = PrivateAttr(default=None)
+
     @classmethod
     def new(
         cls,
@@ -25,14 +66,18 @@ class Post(BaseModel):
         id: str | None = None,
         attachments: list[Attachment] | None = None,
         original_messages: list[BaseMessage | dict] | None = None,
+        validate: bool = True,
     ) -> "Post":
-        id = id if id is not None else str(uuid.uuid4())
+        """Creates a post. Set `validate` to False to skip the validation of trusted values."""
+        id = id if id is not None else new_id()
         attachments = attachments if attachments is not None else []
+        live_messages = None
         if original_messages is not None:
-            original_messages = [
-                msg.to_json() if isinstance(msg, BaseMessage) else msg for msg in original_messages
-            ]
-        return cls(
+            if all(isinstance(msg, BaseMessage) for msg in original_messages):
+                live_messages = list(original_messages)
+            original_messages = [dump_message(msg) for msg in original_messages]
+        factory = cls if validate else cls.model_construct
+        post = factory(
             id=id,
             send_from=send_from,
             send_to=send_to,
@@ -40,6 +85,9 @@ class Post(BaseModel):
             attachments=attachments,
             original_messages=original_messages,
         )
+        # Messages created in-process do not need to be deserialized again
+        post._loaded_original_messages = live_messages
+        return post
 
     def update(self, update: "PostUpdate") -> "Post":
         """CAUTION: This method does not mutate the post in place. It returns a new post."""
@@ -47,35 +95,83 @@ class Post(BaseModel):
         if update.id != self.id:
             raise ValueError("PostUpdate.id does not match the post's id")
 
+        if (
+            (update.send_from is None or update.send_from == self.send_from)
+            and (update.send_to is None or update.send_to == self.send_to)
+            and (update.message is None or update.message == self.message)
+            and not update.attachments
+            and not update.original_messages
+        ):
+            # Nothing to change, keep this post so that its identity is preserved
+            return self
+
+        attachments = self.attachments
+        if update.attachments is not None:
+            # Build a new list rather than `extend`, which would mutate this post's list in place
+            attachments = attachments + update.attachments
+
+        original_messages = self.original_messages
+        if update.original_messages is not None:
+            # Copy once and append the dumped messages into the copy
+            original_messages = list(original_messages) if original_messages is not None else []
+            original_messages.extend(dump_message(msg) for msg in update.original_messages)
+
         post = Post.new(
             id=self.id,
             send_from=update.send_from if update.send_from is not None else self.send_from,
             send_to=update.send_to if update.send_to is not None else self.send_to,
             message=update.message if update.message is not None else self.message,
-            attachments=self.attachments,
-            original_messages=self.original_messages,
+            attachments=attachments,
+            original_messages=original_messages,
+            # All the values come from this post or the validated update
+            validate=False,
         )
 
-        if update.attachments is not None:
-            # Do not use `extend` because it mutates the list in place
-            post.attachments = post.attachments + update.attachments
-
-        if update.original_messages is not None:
-            if post.original_messages is None:
-                post.original_messages = []
-            original_messages = [
-                msg.to_json() if isinstance(msg, BaseMessage) else msg for msg in update.original_messages
-            ]
-            # Do not use `extend` because it mutates the list in place
-            post.original_messages = post.original_messages + original_messages
+        if update.original_messages is None:
+            # The original messages are unchanged, so are the deserialized ones
+            post._loaded_original_messages = self._loaded_original_messages
+        elif all(isinstance(msg, BaseMessage) for msg in update.original_messages):
+            if self.original_messages is None:
+                post._loaded_original_messages = list(update.original_messages)
+            elif self._loaded_original_messages is not None:
+                post._loaded_original_messages = self._loaded_original_messages + list(
+                    update.original_messages
+                )
 
         return post
 
-    def get_attachments(self, attachment_type: str | None = None) -> list[Attachment]:
+    @property
+    def attachments_by_type(self) -> dict[AttachmentType, list[Attachment]]:
+        # `attachments` is replaced rather than mutated, so the identity tells if it is stale
+        if self._attachments_by_type is None or self._attachments_by_type[0] is not self.attachments:
+            by_type: dict[AttachmentType, list[Attachment]] = {}
+            for attachment in self.attachments:
+                by_type.setdefault(attachment.type, []).append(attachment)
+            self._attachments_by_type = (self.attachments, by_type)
+        return self._attachments_by_type[1]
+
+    def get_attachments(self, attachment_type: AttachmentType | str | None = None) -> list[Attachment]:
         if attachment_type is None:
             return self.attachments
         else:
-            return [a for a in self.attachments if a.type == attachment_type]
+            # `AttachmentType` is a str enum, so its members and their values share the same key
+            return self.attachments_by_type.get(attachment_type, [])
+
+    def get_original_messages(self) -> list[BaseMessage]:
+        if self.original_messages is None:
+            return []
+
+        if self._loaded_original_messages is None:
+            self._loaded_original_messages = [load_message(msg) for msg in self.original_messages]
+        return self._loaded_original_messages
+
+    def get_formatted_message(self, key: Any) -> BaseMessage | None:
+        if self._formatted_message is not None and self._formatted_message[0] == key:
+            return self._formatted_message[1]
+        return None
+
+    def set_formatted_message(self, key: Any, message: BaseMessage) -> None:
+        self._formatted_message = (key, message)
 
 
 class PostUpdate(BaseModel):
@@ -104,4 +200,6 @@ class PostUpdate(BaseModel):
             message=self.message,
             attachments=self.attachments,
             original_messages=self.original_messages,
+            # All the values come from this post or the validated update
+            validate=False,
         )
@@ -1,8 +1,9 @@
-import uuid
 from typing import Literal
 
 from pydantic import BaseModel
 
+from scimate_agent.utils.ids import new_id
+
 from .post import Post, PostUpdate
 
 RoundStatus = Literal["created", "finished", "failed"]
@@ -22,7 +23,7 @@ class Round(BaseModel):
         posts: list[Post] | None = None,
         status: RoundStatus = "created",
     ) -> "Round":
-        id = id if id is not None else str(uuid.uuid4())
+        id = id if id is not None else new_id()
         if posts is None or len(posts) == 0:
             posts = [
                 Post.new(
@@ -51,15 +52,16 @@ def update_rounds(
         updates = [updates]
     assert isinstance(updates, (list, tuple)), f"updates must be a list or tuple, got {type(updates)}"
 
+    # Built once and kept up to date, instead of scanning the rounds for every update
+    round_idx_by_id: dict[str, int] = {}
+    for i, r in enumerate(rounds):
+        round_idx_by_id.setdefault(r.id, i)
+
     for update in updates:
         assert isinstance(update, (RoundUpdate, Round)), f"updates must be a list of RoundUpdate or Round, got {type(update)}"
 
-        if update.id is None:
-            round = None
-        else:
-            round_idx, round = next(
-                ((i, r) for i, r in enumerate(rounds) if r.id == update.id), (None, None)
-            )
+        round_idx = round_idx_by_id.get(update.id) if update.id is not None else None
+        round = rounds[round_idx] if round_idx is not None else None
 
         if round is None:
             # Start a new round
@@ -67,39 +69,51 @@ def update_rounds(
                 raise ValueError("user_query is required")
 
             new_round = Round(
-                id=update.id if update.id is not None else str(uuid.uuid4()),
+                id=update.id if update.id is not None else new_id(),
                 user_query=update.user_query,
                 posts=update.posts if update.posts is not None else [],
                 status=update.status if update.status is not None else "created",
             )
+            round_idx_by_id.setdefault(new_round.id, len(rounds))
             rounds.append(new_round)
         else:
             # Update an existing round
-            new_round = round.model_copy()
-
-            if update.user_query is not None:
-                new_round.user_query = update.user_query
-
-            if update.posts is not None:
+            new_posts = None
+            if update.posts:
                 # Do not use `extend` because it mutates the list in place
-                new_posts = [p for p in new_round.posts]
-                existing_posts = {p.id: p for p in new_posts}
+                new_posts = [p for p in round.posts]
+                post_idx_by_id = {p.id: i for i, p in enumerate(new_posts)}
                 for post in update.posts:
                     if isinstance(post, PostUpdate):
-                        if post.id in existing_posts:
-                            existing_posts[post.id] = existing_posts[post.id].update(post)
-                        else:
-                            new_posts.append(post.to_post())
-                    elif isinstance(post, Post):
-                        new_posts.append(post)
-                    else:
+                        post_idx = post_idx_by_id.get(post.id)
+                        if post_idx is not None:
+                            new_posts[post_idx] = new_posts[post_idx].update(post)
+                            continue
+                        post = post.to_post()
+                    elif not isinstance(post, Post):
                         raise ValueError(f"Invalid post: {post}")
 
-                new_round.posts = new_posts
-
-            if update.status is not None:
-                new_round.status = update.status
-
-            rounds[round_idx] = new_round
+                    post_idx_by_id[post.id] = len(new_posts)
+                    new_posts.append(post)
+
+                if len(new_posts) == len(round.posts) and all(
+                    new is old for new, old in zip(new_posts, round.posts)
+                ):
+                    # Every post update was a no-op
+                    new_posts = None
+
+            user_query_changed = update.user_query is not None and update.user_query != round.user_query
+            status_changed = update.status is not None and update.status != round.status
+            if new_posts is None and not user_query_changed and not status_changed:
+                # Keep the round as is, so unchanged rounds keep their identity
+                continue
+
+            # The fields come from the round or the validated update, so skip the validation
+            rounds[round_idx] = Round.model_construct(
+                id=round.id,
+                user_query=update.user_query if user_query_changed else round.user_query,
+                posts=new_posts if new_posts is not None else round.posts,
+                status=update.status if status_changed else round.status,
+            )
 
     return rounds
@@ -30,7 +30,19 @@ class AgentState(BaseModel):
             plugins=[] if plugins is None else plugins,
         )
 
+    def get_last_round(self, include_failure_rounds: bool = False) -> Round | None:
+        """Returns the last round as is, without copying all the rounds like `get_rounds`."""
+        for round in reversed(self.rounds):
+            if round.status == "failed" and not include_failure_rounds:
+                continue
+            return round
+        return None
+
     def get_rounds(self, role: Role | None = None, include_failure_rounds: bool = False) -> list[Round]:
+        if role is None and include_failure_rounds:
+            # Nothing to filter at all
+            return list(self.rounds)
+
         rounds: list[Round] = []
 
         for round in self.rounds:
@@ -38,14 +50,19 @@ class AgentState(BaseModel):
             if round.status == "failed" and not include_failure_rounds:
                 continue
 
-            new_round = round.model_copy()
-            new_round.posts = [
-                post
-                for post in round.posts
-                if role is None or post.send_from == role or post.send_to == role
-            ]
+            if role is None:
+                # Nothing to filter, the rounds are not modified by the callers
+                rounds.append(round)
+                continue
 
-            rounds.append(new_round)
+            rounds.append(
+                Round.model_construct(
+                    id=round.id,
+                    user_query=round.user_query,
+                    posts=[post for post in round.posts if post.send_from == role or post.send_to == role],
+                    status=round.status,
+                )
+            )
 
         return rounds
 
@@ -62,7 +79,23 @@ class CodeInterpreterState(BaseModel):
     env_dir: str | None = None
     session_id: str | None = None
 
+    # Summary of the rounds that rolled off the history window, and the id of the last of them
+    history_summary: str | None = None
+    history_summary_round_id: str | None = None
+
+    def get_last_round(self, include_failure_rounds: bool = False) -> Round | None:
+        """Returns the last round as is, without copying all the rounds like `get_rounds`."""
+        for round in reversed(self.rounds):
+            if round.status == "failed" and not include_failure_rounds:
+                continue
+            return round
+        return None
+
     def get_rounds(self, role: Role | None = None, include_failure_rounds: bool = False) -> list[Round]:
+        if role is None and include_failure_rounds:
+            # Nothing to filter at all
+            return list(self.rounds)
+
         rounds: list[Round] = []
 
         for round in self.rounds:
@@ -70,13 +103,18 @@ class CodeInterpreterState(BaseModel):
             if round.status == "failed" and not include_failure_rounds:
                 continue
 
-            new_round = round.model_copy()
-            new_round.posts = [
-                post
-                for post in round.posts
-                if role is None or post.send_from == role or post.send_to == role
-            ]
+            if role is None:
+                # Nothing to filter, the rounds are not modified by the callers
+                rounds.append(round)
+                continue
 
-            rounds.append(new_round)
+            rounds.append(
+                Round.model_construct(
+                    id=round.id,
+                    user_query=round.user_query,
+                    posts=[post for post in round.posts if post.send_from == role or post.send_to == role],
+                    status=round.status,
+                )
+            )
 
         return rounds
@@ -1,7 +1,16 @@
+import time
 from datetime import datetime
+from functools import lru_cache
 
 
-def get_env_context() -> str:
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+@lru_cache(maxsize=1)
+def _format_env_context(timestamp: int) -> str:
+    current_time = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
 
     return f"- Current time: {current_time}\n"
+
+
+def get_env_context() -> str:
+    # The context only changes with the current time, which is shown to the second,
+    # so it is formatted once per second.
+    return _format_env_context(int(time.time()))
@@ -0,0 +1,71 @@
+"""A `json`-compatible module backed by `orjson` when it is installed."""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Keyword arguments of `json.dumps` that have an `orjson` equivalent
+_ORJSON_DUMPS_KWARGS = frozenset({"default", "sort_keys", "indent", "separators"})
+
+
+def _can_use_orjson_dumps(args: tuple, kwargs: dict[str, Any]) -> bool:
+    return (
+        orjson is not None
+        and not args
+        and kwargs.keys() <= _ORJSON_DUMPS_KWARGS
+        and kwargs.get("indent") in (None, 2)
+        # `orjson` only produces compact output, unless indented
+        and kwargs.get("separators") in (None, (",", ":"))
+    )
+
+
+def dumps(obj: Any, *args: Any, **kwargs: Any) -> str:
+    """Like `json.dumps`, but the output is compact unless `indent` is given."""
+    if not _can_use_orjson_dumps(args, kwargs):
+        return json.dumps(obj, *args, **kwargs)
+
+    # Like `json`, serialize non-str keys
+    option = orjson.OPT_NON_STR_KEYS
+    if kwargs.get("sort_keys"):
+        option |= orjson.OPT_SORT_KEYS
+    if kwargs.get("indent") == 2:
+        option |= orjson.OPT_INDENT_2
+    try:
+        return orjson.dumps(obj, default=kwargs.get("default"), option=option).decode("utf-8")
+    except orjson.JSONEncodeError:
+        # e.g., integers wider than 64 bits, which `json` supports. Keep the output compact.
+        if kwargs.get("indent") is None:
+            kwargs.setdefault("separators", (",", ":"))
+        return json.dumps(obj, **kwargs)
+
+
+def loads(s: str | bytes, *args: Any, **kwargs: Any) -> Any:
+    if orjson is None or args or kwargs:
+        # `orjson.loads` takes no options
+        return json.loads(s, *args, **kwargs)
+    return orjson.loads(s)
+
+
+def dumpb(obj: Any, sort_keys: bool = False) -> bytes:
+    """Serializes `obj` to compact UTF-8 JSON bytes, e.g., for hashing.
+
+    The output of `orjson` is not byte-identical to the `json` fallback (e.g., for some floats),
+    so the bytes are only stable across environments that agree on whether `orjson` is installed.
+    """
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=option)
+        except orjson.JSONEncodeError:
+            # e.g., integers wider than 64 bits, which `json` supports
+            pass
+    return json.dumps(
+        obj, sort_keys=sort_keys, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
@@ -0,0 +1,41 @@
+import asyncio
+import weakref
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+# An `httpx.AsyncClient` is bound to the event loop it first runs on, so keep one per loop
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_shared_async_http_client() -> "httpx.AsyncClient":
+    """Returns an HTTP client shared by the LLM clients of the running event loop,
+    so that they share a connection pool.
+
+    Only the OpenAI clients use it, `ChatAnthropic` does not take an HTTP client and
+    keeps its own.
+    """
+
+    import httpx
+
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+            # Same as the default of the OpenAI SDK, long generations take minutes
+            timeout=httpx.Timeout(timeout=600.0, connect=5.0),
+        )
+        _clients[loop] = client
+    return client
+
+
+async def aclose_shared_async_http_client() -> None:
+    """Closes the shared HTTP client of the running event loop, if it was created."""
+
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
@@ -0,0 +1,26 @@
+import os
+import uuid
+from collections import deque
+
+ID_POOL_SIZE = 128
+
+# Preallocated random ids, refilled from a single `os.urandom` call
+_id_pool: deque[str] = deque()
+
+# A forked process must not hand out the same ids as its parent
+os.register_at_fork(after_in_child=_id_pool.clear)
+
+
+def new_id() -> str:
+    """Returns a new random UUID4 string, same as `str(uuid.uuid4())`."""
+
+    try:
+        return _id_pool.popleft()
+    except IndexError:
+        pass
+
+    raw = os.urandom(16 * ID_POOL_SIZE)
+    _id_pool.extend(
+        str(uuid.UUID(bytes=raw[i : i + 16], version=4)) for i in range(16, len(raw), 16)
+    )
+    return str(uuid.UUID(bytes=raw[:16], version=4))
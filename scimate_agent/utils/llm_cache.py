@@ -0,0 +1,25 @@
+import hashlib
+from typing import Any
+
+from langchain_core.caches import InMemoryCache
+
+
+class HashedInMemoryCache(InMemoryCache):
+    """In-memory LLM cache keyed by the SHA-256 digest of the prompt.
+
+    The prompts of the agents contain the whole conversation, so keeping them as keys
+    would hold on to a lot of memory for a bounded number of entries.
+
+    It is looked up and updated explicitly around the streamed calls, with a key of the model
+    parameters chosen by the caller, instead of being set as the model's cache.
+    """
+
+    def lookup(self, prompt: str, llm_string: str) -> Any:
+        return super().lookup(_digest(prompt), llm_string)
+
+    def update(self, prompt: str, llm_string: str, return_val: Any) -> None:
+        super().update(_digest(prompt), llm_string, return_val)
+
+
+def _digest(prompt: str) -> str:
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
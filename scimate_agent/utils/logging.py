@@ -1,5 +1,9 @@
+import atexit
+import copy
 import logging
 import logging.config
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from typing import TypeAlias, MutableMapping, Any
 
 import structlog
@@ -7,6 +11,7 @@ import uvicorn
 
 from scimate_agent.app.middlewares.correlation import correlation_id
 from scimate_agent.app.settings import settings
+from scimate_agent.utils import fast_json
 
 EventDict: TypeAlias = MutableMapping[str, Any]
 
@@ -15,13 +20,17 @@ DEBUG: bool = settings.log_level == "DEBUG"
 
 
 def add_correlation_id(_, __, event_dict: EventDict) -> EventDict:
-    if cid := correlation_id.get():
+    # `correlation_id` defaults to None, so `get` never raises
+    cid = correlation_id.get()
+    if cid is not None:
         event_dict["correlation_id"] = cid
     return event_dict
 
 
 def remove_color_message(_, __, event_dict: EventDict) -> EventDict:
-    event_dict.pop("color_message", None)
+    # The key is usually absent
+    if "color_message" in event_dict:
+        del event_dict["color_message"]
     return event_dict
 
 
@@ -47,13 +56,13 @@ LOGGING_CONFIG: dict[str, Any] = {
         "json": {
             "()": structlog.stdlib.ProcessorFormatter,
             # Render the final event dict as JSON.
-            "processor": structlog.processors.JSONRenderer(),
+            "processor": structlog.processors.JSONRenderer(serializer=fast_json.dumps),
             "foreign_pre_chain": SHARED_PROCESSORS,
         },
         "colored": {
             "()": structlog.stdlib.ProcessorFormatter,
+            # `color_message` is already removed by `SHARED_PROCESSORS`
             "processors": [
-                remove_color_message,
                 structlog.stdlib.ProcessorFormatter.remove_processors_meta,
                 structlog.dev.ConsoleRenderer(colors=True),
             ],
@@ -88,8 +97,63 @@ LOGGING_CONFIG: dict[str, Any] = {
 }
 
 
+class StructlogQueueHandler(QueueHandler):
+    """Hands the records over to the listener thread, where they are formatted and written."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Do not format here like `QueueHandler` does, `ProcessorFormatter` needs the event dict
+        record = copy.copy(record)
+        if not isinstance(record.msg, dict):
+            # Foreign records go through `foreign_pre_chain` in the listener thread,
+            # so capture the context variables now and let `ExtraAdder` pick them up.
+            for key, value in structlog.contextvars.get_contextvars().items():
+                record.__dict__.setdefault(key, value)
+            if cid := correlation_id.get():
+                record.__dict__.setdefault("correlation_id", cid)
+        return record
+
+
+_queue_listener: QueueListener | None = None
+
+
+def _install_queue_handler() -> None:
+    """Moves the configured handlers behind a queue, so that logging does not block on the stream I/O."""
+
+    global _queue_listener
+
+    _stop_queue_listener()
+
+    loggers = [logging.getLogger(name) for name in LOGGING_CONFIG["loggers"]]
+    handlers: list[logging.Handler] = []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+
+    log_queue: queue.Queue = queue.Queue()
+    queue_handler = StructlogQueueHandler(log_queue)
+    for logger in loggers:
+        logger.handlers = [queue_handler]
+
+    _queue_listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _queue_listener.start()
+
+
+def _stop_queue_listener() -> None:
+    global _queue_listener
+
+    if _queue_listener is not None:
+        # Flushes the queued records
+        _queue_listener.stop()
+        _queue_listener = None
+
+
+atexit.register(_stop_queue_listener)
+
+
 def setup_logging() -> None:
     logging.config.dictConfig(LOGGING_CONFIG)
+    _install_queue_handler()
     # noinspection PyTypeChecker
     structlog.configure(
         processors=[
@@ -105,13 +169,19 @@ def setup_logging() -> None:
             structlog.processors.format_exc_info,
             # If some value is in bytes, decode it to a unicode str.
             structlog.processors.UnicodeDecoder(),
-            # Add callsite parameters.
-            structlog.processors.CallsiteParameterAdder(
-                {
-                    structlog.processors.CallsiteParameter.FILENAME,
-                    structlog.processors.CallsiteParameter.FUNC_NAME,
-                    structlog.processors.CallsiteParameter.LINENO,
-                }
+            # Add callsite parameters. It inspects the call stack on every event, so only when debugging.
+            *(
+                (
+                    structlog.processors.CallsiteParameterAdder(
+                        {
+                            structlog.processors.CallsiteParameter.FILENAME,
+                            structlog.processors.CallsiteParameter.FUNC_NAME,
+                            structlog.processors.CallsiteParameter.LINENO,
+                        }
+                    ),
+                )
+                if DEBUG
+                else ()
             ),
             structlog.stdlib.ProcessorFormatter.wrap_for_formatter,
         ],
@@ -1,13 +1,52 @@
+import os
+from functools import lru_cache
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
+import structlog
+
+if TYPE_CHECKING:
+    from structlog.stdlib import BoundLogger
+
+logger: "BoundLogger" = structlog.get_logger()
+
+
+@lru_cache(maxsize=1)
+def _get_loader_and_dumper() -> tuple[type, type]:
+    """Returns the safe YAML loader and dumper, backed by libyaml when it is available."""
+
+    try:
+        from yaml import CSafeDumper, CSafeLoader
+
+        return CSafeLoader, CSafeDumper
+    except ImportError:
+        from yaml import SafeDumper, SafeLoader
+
+        logger.warning("libyaml is not available, falling back to the pure-Python YAML parser.")
+        return SafeLoader, SafeDumper
+
+
+@lru_cache(maxsize=128)
+def _load_yaml(path: str, mtime_ns: int, size: int) -> Any:
+    """Parses a YAML file. Keyed by the modification time and size, so a changed file is parsed again."""
 
-def read_yaml(path: str | Path) -> dict[str, Any]:
     import yaml
 
+    loader, _ = _get_loader_and_dumper()
+
+    # libyaml decodes the bytes itself
+    with open(path, "rb") as f:
+        return yaml.load(f, Loader=loader)
+
+
+def read_yaml(path: str | Path) -> dict[str, Any]:
+    """Reads a YAML file. The parsed content is cached until the file changes, so it is shared
+    between the callers and must not be modified."""
+
     try:
-        with open(path, "r") as f:
-            return yaml.safe_load(f)
+        key = os.fspath(path)
+        stat = os.stat(key)
+        return _load_yaml(key, stat.st_mtime_ns, stat.st_size)
     except Exception as e:
         raise ValueError(f"Error reading YAML file {path}: {e}")
 
@@ -15,8 +54,10 @@ def read_yaml(path: str | Path) -> dict[str, Any]:
 def write_yaml(path: str | Path, data: dict[str, Any]) -> None:
     import yaml
 
+    _, dumper = _get_loader_and_dumper()
+
     try:
-        with open(path, "w") as f:
-            yaml.safe_dump(data, f, sort_keys=False)
+        with open(path, "wb") as f:
+            yaml.dump(data, f, Dumper=dumper, sort_keys=False, encoding="utf-8")
     except Exception as e:
         raise ValueError(f"Error writing YAML file {path}: {e}")
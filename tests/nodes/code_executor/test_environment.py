@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("jupyter_client")
+
+from scimate_agent.nodes.code_executor.session.common import Plugin, Session  # noqa: E402
+from scimate_agent.nodes.code_executor.session.environment import Environment  # noqa: E402
+
+
+class FakeKernel:
+    def __init__(self, alive: bool) -> None:
+        self.alive = alive
+
+    async def _async_is_alive(self) -> bool:
+        return self.alive
+
+
+@pytest.fixture
+def env(tmp_path) -> Environment:
+    return Environment(env_id="test", env_dir=str(tmp_path))
+
+
+@pytest.fixture
+def session(env: Environment, tmp_path) -> Session:
+    session = env._get_session("s0", str(tmp_path / "sessions" / "s0"))
+    session.plugins["p0"] = Plugin(name="p0", package=b"", config=None, loaded=True)
+    session.plugins["p1"] = Plugin(name="p1", package=b"", config=None, loaded=False)
+    return session
+
+
+def record_restart(env: Environment, session: Session, calls: list) -> None:
+    """Replaces the restart of the kernel, records the plugins of the session at each step."""
+
+    async def stop_session(session_id: str) -> None:
+        calls.append(("stop", session_id, list(session.plugins)))
+
+    async def start_session(session_id: str, session_dir: str | None = None, cwd: str | None = None) -> None:
+        calls.append(("start", session_id, list(session.plugins)))
+
+    env.stop_session = stop_session
+    env.start_session = start_session
+
+
+@pytest.mark.parametrize("kernel_status", ["pending", "error", "ready"])
+def test_reset_session_restarts_dead_kernel(env, session, kernel_status, monkeypatch):
+    session.kernel_status = kernel_status
+    session.kernel_id = "k0"
+    monkeypatch.setattr(env.kernel_manager, "get_kernel", lambda kernel_id: FakeKernel(alive=False))
+    calls = []
+    record_restart(env, session, calls)
+
+    asyncio.run(env.reset_session("s0"))
+
+    # The new kernel has none of the plugins loaded, so they are dropped before the restart
+    assert calls == [("stop", "s0", []), ("start", "s0", [])]
+    assert session.plugins == {}
+
+
+def test_reset_session_reuses_live_kernel(env, session, monkeypatch):
+    session.kernel_status = "ready"
+    session.kernel_id = "k0"
+    monkeypatch.setattr(env.kernel_manager, "get_kernel", lambda kernel_id: FakeKernel(alive=True))
+    calls = []
+    record_restart(env, session, calls)
+
+    async def unload_plugin(session: Session, plugin: Plugin) -> None:
+        calls.append(("unload", plugin.name))
+
+    async def execute_code_on_kernel(session_id: str, exec_id: str, code: str, **kwargs) -> None:
+        calls.append(("execute", code))
+
+    async def session_init(session: Session) -> None:
+        calls.append(("init", session.session_id))
+
+    env._cmd_unload_plugin = unload_plugin
+    env._execute_code_on_kernel = execute_code_on_kernel
+    env._cmd_session_init = session_init
+
+    asyncio.run(env.reset_session("s0"))
+
+    # Only the loaded plugins are unloaded, and the kernel is not restarted
+    assert calls == [("unload", "p0"), ("execute", "%reset -f -s"), ("init", "s0")]
+    assert session.plugins == {}
+
+
+def test_reset_unknown_session(env):
+    with pytest.raises(ValueError, match="Session s1 not found"):
+        asyncio.run(env.reset_session("s1"))
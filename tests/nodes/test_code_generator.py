@@ -0,0 +1,247 @@
+import asyncio
+import json
+
+import pytest
+from langchain_core.messages import AIMessage, HumanMessage
+
+from scimate_agent.config import AgentConfig
+from scimate_agent.nodes import code_generator
+from scimate_agent.nodes.code_generator import (
+    CodeGenerationResult,
+    apply_history_window,
+    compress_history,
+    parse_code_generation_result,
+    try_local_repair,
+)
+from scimate_agent.state import CodeInterpreterState, Round
+
+
+def make_rounds(n: int) -> list[Round]:
+    return [Round.new(user_query=f"query {i}", id=f"r{i}") for i in range(n)]
+
+
+def make_state(
+    rounds: list[Round],
+    history_summary: str | None = None,
+    history_summary_round_id: str | None = None,
+) -> CodeInterpreterState:
+    return CodeInterpreterState.model_construct(
+        rounds=rounds,
+        plugins=[],
+        history_summary=history_summary,
+        history_summary_round_id=history_summary_round_id,
+    )
+
+
+@pytest.fixture
+def summarize_calls(monkeypatch: pytest.MonkeyPatch) -> list[tuple[list[str], str | None]]:
+    """Replaces the summary LLM, records the ids of the summarized rounds and the previous summary."""
+
+    calls: list[tuple[list[str], str | None]] = []
+
+    async def fake_summarize_rounds(
+        agent_config: AgentConfig,
+        rounds: list[Round],
+        summary: str | None = None,
+    ) -> str:
+        round_ids = [r.id for r in rounds]
+        calls.append((round_ids, summary))
+        return f"{summary or ''}+{','.join(round_ids)}"
+
+    monkeypatch.setattr(code_generator, "summarize_rounds", fake_summarize_rounds)
+    return calls
+
+
+def run_history_window(state: CodeInterpreterState, rounds: list[Round], window: int | None):
+    return asyncio.run(apply_history_window(state, rounds, AgentConfig(history_window=window)))
+
+
+def test_history_window_disabled(summarize_calls):
+    rounds = make_rounds(5)
+    state = make_state(rounds, history_summary="S", history_summary_round_id="r1")
+
+    assert run_history_window(state, rounds, None) == (rounds, "S", "r1")
+    assert summarize_calls == []
+
+
+@pytest.mark.parametrize("n_rounds", [1, 3])
+def test_history_window_not_full(summarize_calls, n_rounds):
+    rounds = make_rounds(n_rounds)
+    state = make_state(rounds)
+
+    assert run_history_window(state, rounds, 3) == (rounds, None, None)
+    assert summarize_calls == []
+
+
+def test_history_window_summarizes_old_rounds(summarize_calls):
+    rounds = make_rounds(5)
+    state = make_state(rounds)
+
+    window_rounds, summary, summary_round_id = run_history_window(state, rounds, 2)
+
+    assert window_rounds == rounds[-2:]
+    assert summarize_calls == [(["r0", "r1", "r2"], None)]
+    assert summary == "+r0,r1,r2"
+    assert summary_round_id == "r2"
+
+
+def test_history_window_reuses_summary(summarize_calls):
+    rounds = make_rounds(5)
+    state = make_state(rounds, history_summary="S", history_summary_round_id="r1")
+
+    window_rounds, summary, summary_round_id = run_history_window(state, rounds, 2)
+
+    # Only the round that newly rolled off the window is summarized
+    assert window_rounds == rounds[-2:]
+    assert summarize_calls == [(["r2"], "S")]
+    assert summary == "S+r2"
+    assert summary_round_id == "r2"
+
+
+def test_history_window_summary_up_to_date(summarize_calls):
+    rounds = make_rounds(5)
+    state = make_state(rounds, history_summary="S", history_summary_round_id="r2")
+
+    assert run_history_window(state, rounds, 2) == (rounds[-2:], "S", "r2")
+    assert summarize_calls == []
+
+
+def test_history_window_across_turns(summarize_calls):
+    rounds = make_rounds(3)
+    _, summary, summary_round_id = run_history_window(make_state(rounds), rounds, 2)
+    assert (summary, summary_round_id) == ("+r0", "r0")
+
+    # The next turn adds a round, the previous summary is extended with the round that rolled off
+    rounds = make_rounds(4)
+    state = make_state(rounds, history_summary=summary, history_summary_round_id=summary_round_id)
+    _, summary, summary_round_id = run_history_window(state, rounds, 2)
+
+    assert summarize_calls == [(["r0"], None), (["r1"], "+r0")]
+    assert (summary, summary_round_id) == ("+r0+r1", "r1")
+
+
+def test_history_window_unknown_summary_round(summarize_calls):
+    rounds = make_rounds(4)
+    state = make_state(rounds, history_summary="stale", history_summary_round_id="r3")
+
+    _, summary, summary_round_id = run_history_window(state, rounds, 2)
+
+    # The summary does not cover the old rounds, so it starts over
+    assert summarize_calls == [(["r0", "r1"], None)]
+    assert (summary, summary_round_id) == ("+r0,r1", "r1")
+
+
+def make_reply(reply_content: str, reply_type: str = "python", thought: str = "thought") -> AIMessage:
+    return AIMessage(
+        content=CodeGenerationResult(
+            thought=thought,
+            reply_type=reply_type,
+            reply_content=reply_content,
+        ).model_dump_json()
+    )
+
+
+def test_compress_history_keeps_short_history():
+    messages = [HumanMessage(content="q"), make_reply("print(1)")]
+
+    assert compress_history(messages, keep_last=1) is messages
+
+
+def test_compress_history_keeps_last_replies():
+    messages = []
+    for i in range(4):
+        messages.append(HumanMessage(content=f"query {i}"))
+        messages.append(make_reply(f"x = {i}\nprint(x)"))
+    original = list(messages)
+
+    compressed = compress_history(messages, keep_last=2)
+
+    # The input list and its messages are not modified
+    assert messages == original
+    assert len(compressed) == len(messages)
+    # Only the older replies are compressed, the other messages are kept as is
+    for i, (new, old) in enumerate(zip(compressed, messages)):
+        if i in (1, 3):
+            assert new is not old
+        else:
+            assert new is old
+
+    cg_result = CodeGenerationResult.model_validate_json(compressed[1].content)
+    assert cg_result.thought == "thought"
+    assert cg_result.reply_type == "python"
+    assert cg_result.reply_content == "[compressed] 14 chars | x = 0 -> print(x)"
+
+
+def test_compress_history_skips_unparsable_replies():
+    messages = [AIMessage(content="not json"), make_reply("print(1)")]
+
+    compressed = compress_history(messages, keep_last=1)
+
+    assert compressed[0] is messages[0]
+    assert compressed[1] is messages[1]
+
+
+def test_parse_valid_reply():
+    cg_result, error = parse_code_generation_result(make_reply("print(1)"))
+
+    assert error is None
+    assert cg_result == CodeGenerationResult(thought="thought", reply_type="python", reply_content="print(1)")
+
+
+def test_parse_fenced_reply():
+    content = make_reply("print(1)").content
+    cg_result, error = parse_code_generation_result(AIMessage(content=f"```json\n{content}\n```"))
+
+    assert error is None
+    assert cg_result.reply_content == "print(1)"
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # Trailing commas
+        '{"thought": "t", "reply_type": "python", "reply_content": "print(1)",}',
+        # Stray text around the object
+        'Here is the code:\n{"thought": "t", "reply_type": "python", "reply_content": "print(1)"}\nDone.',
+        # Raw newline inside a string
+        '{"thought": "t", "reply_type": "python", "reply_content": "print(1)\nprint(2)"}',
+    ],
+)
+def test_parse_repairs_reply(content):
+    cg_result, error = parse_code_generation_result(AIMessage(content=content))
+
+    assert error is None
+    assert cg_result.thought == "t"
+    assert cg_result.reply_type == "python"
+    assert cg_result.reply_content.startswith("print(1)")
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "print(1)",
+        '{"thought": "t", "reply_content": "print(1)"}',
+        '{"thought": "t", "reply_type": "python", "reply_content": "print(1)"',
+    ],
+)
+def test_parse_unrepairable_reply(content):
+    cg_result, error = parse_code_generation_result(AIMessage(content=content))
+
+    assert isinstance(error, ValueError)
+    # The raw reply is kept, so that it can be revised
+    assert cg_result == CodeGenerationResult(thought="", reply_type="text", reply_content=content)
+
+
+def test_try_local_repair_nested_trailing_commas():
+    content = json.dumps({"thought": "t", "reply_type": "text", "reply_content": "ok"})
+    content = content[:-1] + ', "extra": [1, 2,],}'
+
+    cg_result = try_local_repair(content)
+
+    assert cg_result is not None
+    assert cg_result.reply_content == "ok"
+
+
+def test_try_local_repair_without_object():
+    assert try_local_repair("no object here") is None
+    assert try_local_repair("} {") is None
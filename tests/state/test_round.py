@@ -0,0 +1,99 @@
+import pytest
+
+from scimate_agent.state import Attachment, AttachmentType, Post, Round, RoundUpdate
+from scimate_agent.state.post import PostUpdate
+from scimate_agent.state.round import update_rounds
+
+
+def make_rounds() -> list[Round]:
+    return [Round.new(user_query=f"query {i}", id=f"r{i}") for i in range(3)]
+
+
+def post_updates(round_id: str, *updates: PostUpdate) -> RoundUpdate:
+    # `RoundUpdate.posts` is typed as posts, so post updates skip its validation
+    return RoundUpdate.model_construct(id=round_id, posts=list(updates))
+
+
+def test_post_update_noop_keeps_post():
+    post = Post.new(send_from="Planner", send_to="CodeInterpreter", message="hi")
+
+    assert post.update(PostUpdate(id=post.id)) is post
+    assert post.update(PostUpdate(id=post.id, message="hi", attachments=[])) is post
+
+
+def test_post_update_returns_new_post():
+    post = Post.new(send_from="Planner", send_to="CodeInterpreter", message="hi")
+    attachment = Attachment.new(type=AttachmentType.THOUGHT, content="thinking")
+
+    new_post = post.update(PostUpdate(id=post.id, message="hello", attachments=[attachment]))
+
+    assert new_post is not post
+    assert (new_post.id, new_post.message, new_post.attachments) == (post.id, "hello", [attachment])
+    # The original post is not mutated
+    assert (post.message, post.attachments) == ("hi", [])
+
+
+def test_update_rounds_noop_keeps_rounds():
+    rounds = make_rounds()
+    post = rounds[1].posts[0]
+
+    new_rounds = update_rounds(
+        rounds,
+        [
+            RoundUpdate(id="r1"),
+            RoundUpdate(id="r1", user_query="query 1", status="created"),
+            post_updates("r1", PostUpdate(id=post.id, message=post.message)),
+        ],
+    )
+
+    # The list is copied, but every round keeps its identity
+    assert new_rounds is not rounds
+    assert all(new is old for new, old in zip(new_rounds, rounds, strict=True))
+
+
+def test_update_rounds_changes_only_updated_round():
+    rounds = make_rounds()
+
+    new_rounds = update_rounds(rounds, RoundUpdate(id="r1", status="finished"))
+
+    assert new_rounds[0] is rounds[0]
+    assert new_rounds[2] is rounds[2]
+    assert new_rounds[1] is not rounds[1]
+    assert new_rounds[1].status == "finished"
+    # The posts are unchanged, so is the list of posts
+    assert new_rounds[1].posts is rounds[1].posts
+    assert rounds[1].status == "created"
+
+
+def test_update_rounds_updates_post_in_place():
+    rounds = make_rounds()
+    post = rounds[1].posts[0]
+
+    new_rounds = update_rounds(rounds, post_updates("r1", PostUpdate(id=post.id, message="new")))
+
+    assert [p.id for p in new_rounds[1].posts] == [post.id]
+    assert new_rounds[1].posts[0].message == "new"
+    assert post.message == "query 1"
+
+
+def test_update_rounds_appends_posts_and_rounds():
+    rounds = make_rounds()
+    post = Post.new(send_from="Planner", send_to="CodeInterpreter", message="do it")
+
+    new_rounds = update_rounds(
+        rounds,
+        [
+            RoundUpdate(id="r2", posts=[post]),
+            RoundUpdate(id="r3", user_query="query 3"),
+        ],
+    )
+
+    assert new_rounds[2].posts[-1] is post
+    assert len(rounds[2].posts) == 1
+    assert [r.id for r in new_rounds] == ["r0", "r1", "r2", "r3"]
+    assert new_rounds[3].status == "created"
+
+
+def test_update_rounds_new_round_requires_user_query():
+    with pytest.raises(ValueError, match="user_query is required"):
+        update_rounds(make_rounds(), RoundUpdate(id="r3"))